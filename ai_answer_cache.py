@@ -0,0 +1,161 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from util import store_path
+
+## CONFIGURATION ##
+ANSWER_CACHE_PATH = store_path("ai_answer_cache.db")
+ANSWER_TTL = float(os.getenv("AI_CACHE_TTL_DAYS", "30")) * 86400
+ANSWER_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "200000")) or None
+
+SCHEMA = """
+-- One model judgment per (image bytes, normalized query, model)
+CREATE TABLE IF NOT EXISTS answers (
+    content_hash TEXT NOT NULL,
+    query_key TEXT NOT NULL,
+    model TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (content_hash, query_key, model)
+);
+CREATE INDEX IF NOT EXISTS idx_answers_last_access ON answers(last_access);
+CREATE INDEX IF NOT EXISTS idx_answers_created ON answers(created);
+"""
+
+# Words that don't change whether a photo matches; "top N" only changes how
+# many matches are wanted, not the answer for any single photo
+FILLER_WORDS = {"show", "find", "give", "get", "please", "can", "you", "the", "a", "an", "some", "all", "any"}
+PHOTO_WORDS = {"photo", "photos", "picture", "pictures", "pic", "pics", "image", "images", "shot", "shots"}
+
+def normalize_query(text):
+    """
+    Cache key for a query: lowercase words without punctuation, filler or
+    "top N", with photo/picture/image treated as the same word.
+    """
+    text = re.sub(r"\btop\s+(\d+|one|two|three|four|five|six|seven|eight|nine|ten)\b", " ", text.lower())
+    # "show me" is filler, but "of me" asks for the user's own face
+    text = re.sub(r"\b(show|give|find|get)\s+me\b", " ", text)
+    words = []
+    for word in re.findall(r"[a-z0-9']+", text):
+        if word in FILLER_WORDS:
+            continue
+        words.append("photo" if word in PHOTO_WORDS else word)
+    return " ".join(words)
+
+def normalize_answer(answer):
+    return "yes" if answer.strip().lower().startswith("yes") else "no"
+
+class AnswerCache:
+    """
+    Persistent yes/no answers from the AI search model. Entries expire after
+    ttl seconds, and an optional max_entries cap evicts the least recently
+    used. Hit and miss counts cover this process since it started.
+    """
+
+    def __init__(self, db_path=ANSWER_CACHE_PATH, ttl=ANSWER_TTL, max_entries=ANSWER_MAX_ENTRIES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    @property
+    def conn(self):
+        # SQLite connections can't be shared between threads; give each its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    ## LOOKUPS ##
+    def get_many(self, content_hashes, query, model, count=True):
+        """
+        {content hash: "yes"/"no"} for every image with a fresh answer.
+        With count=False the lookup isn't added to the hit rate, for callers
+        that look ahead and record() only what they end up using.
+        """
+        content_hashes = list(dict.fromkeys(h for h in content_hashes if h))
+        query_key = normalize_query(query)
+        now = time.time()
+        found = {}
+        for content_hash in content_hashes:
+            row = self.conn.execute(
+                "SELECT answer FROM answers WHERE content_hash = ? AND query_key = ? AND model = ? AND created >= ?",
+                (content_hash, query_key, model, now - self.ttl),
+            ).fetchone()
+            if row:
+                found[content_hash] = row[0]
+
+        if found:
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE answers SET last_access = ? WHERE content_hash = ? AND query_key = ? AND model = ?",
+                    [(now, content_hash, query_key, model) for content_hash in found],
+                )
+        if count:
+            self.record(len(found), len(content_hashes) - len(found))
+        return found
+
+    def get(self, content_hash, query, model):
+        return self.get_many([content_hash], query, model).get(content_hash)
+
+    ## WRITES ##
+    def put(self, content_hash, query, model, answer):
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO answers (content_hash, query_key, model, answer, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(content_hash, query_key, model) DO UPDATE SET "
+                "answer = excluded.answer, created = excluded.created, last_access = excluded.last_access",
+                (content_hash, normalize_query(query), model, normalize_answer(answer), now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        self.conn.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,))
+        if not self.max_entries:
+            return
+        count = self.conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM answers WHERE rowid IN "
+                "(SELECT rowid FROM answers ORDER BY last_access LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    ## METRICS ##
+    def record(self, hits=0, misses=0):
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self):
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else None,
+            "entries": self.conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0],
+        }
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+def get_answer_cache():
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+    return _answer_cache
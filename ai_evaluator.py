@@ -0,0 +1,378 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from image_index import content_hashes as indexed_hashes
+from util import JPEG_FORMATS
+
+## CONFIGURATION ##
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash-latest")
+# Point the client at another server, e.g. the local stub below
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+AI_MAX_IN_FLIGHT = int(os.getenv("AI_MAX_IN_FLIGHT", "8"))
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "3"))
+AI_BACKOFF_SECONDS = float(os.getenv("AI_BACKOFF_SECONDS", "0.5"))
+# Photos per request; 1 sends one photo per request as before
+AI_BATCH_SIZE = int(os.getenv("AI_BATCH_SIZE", "8"))
+# Photos are downscaled to this longest side before upload (0 sends the original bytes)
+AI_MAX_SIDE = int(os.getenv("AI_MAX_SIDE", "768"))
+AI_JPEG_QUALITY = 85
+# Rate limits and transient server errors are worth another try; bad requests are not
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+PROMPT = """
+Given the user's request: {query}
+Does the following photo fulfill the user's request?
+Answer only with 'yes' or 'no'.
+"""
+
+BATCH_PROMPT = """
+Given the user's request: {query}
+For each of the {count} photos above, numbered 1 to {count}, decide whether it fulfills the user's request.
+Reply only with a JSON array containing one object per photo, in order, like:
+[{{"photo": 1, "answer": "yes"}}, {{"photo": 2, "answer": "no"}}]
+"""
+
+MIME_TYPES = {"JPEG": "image/jpeg", "MPO": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+def make_client(api_key=None, base_url=GEMINI_BASE_URL):
+    from google import genai
+    from google.genai import types
+    http_options = types.HttpOptions(base_url=base_url) if base_url else None
+    return genai.Client(api_key=api_key or os.getenv("GEMINI"), http_options=http_options)
+
+def encode_image(image_path, max_side=AI_MAX_SIDE):
+    """
+    (bytes, mime type) to upload for a photo. Photos larger than max_side
+    are downscaled with EXIF orientation applied: PNGs with transparency
+    stay PNG, everything else becomes JPEG. Smaller photos are sent as they
+    are, labelled with their real format.
+    """
+    from PIL import Image, ImageOps
+    with Image.open(image_path) as img:
+        fmt = img.format
+        if not max_side or max(img.size) <= max_side:
+            if fmt in MIME_TYPES:
+                with open(image_path, "rb") as f:
+                    return f.read(), MIME_TYPES[fmt]
+            max_side = max(img.size)
+        if fmt in JPEG_FORMATS:
+            img.draft("RGB", (max_side, max_side))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_side, max_side))
+        buffer = io.BytesIO()
+        if fmt == "PNG" and img.mode in ("RGBA", "LA", "P"):
+            img.save(buffer, format="PNG", optimize=True)
+            return buffer.getvalue(), "image/png"
+        img.convert("RGB").save(buffer, format="JPEG", quality=AI_JPEG_QUALITY)
+        return buffer.getvalue(), "image/jpeg"
+
+def parse_batch_answers(text, count):
+    """
+    [answer or None] * count from a JSON batch reply; photos the reply
+    leaves out (or an unreadable reply) come back as None.
+    """
+    try:
+        items = json.loads(re.sub(r"^```(?:json)?|```$", "", (text or "").strip()).strip())
+    except ValueError:
+        return [None] * count
+    if isinstance(items, dict):
+        items = items.get("answers", items.get("photos", []))
+    answers = [None] * count
+    for index, item in enumerate(items if isinstance(items, list) else []):
+        if isinstance(item, dict):
+            number, answer = item.get("photo", index + 1), item.get("answer")
+        else:
+            number, answer = index + 1, item
+        if isinstance(number, int) and 1 <= number <= count and isinstance(answer, str):
+            answers[number - 1] = answer.strip().lower()
+    return answers
+
+class AIEvaluator:
+    """
+    Asks the model whether each candidate photo fulfills a query, with at
+    most max_in_flight requests open at once and retries with exponential
+    backoff. Candidates are submitted in order, batch_size downscaled photos
+    per request, and no new requests are sent once top_n photos have been
+    accepted.
+    """
+
+    def __init__(self, client, model=GEMINI_MODEL, max_in_flight=AI_MAX_IN_FLIGHT,
+                 max_retries=AI_MAX_RETRIES, backoff=AI_BACKOFF_SECONDS, answer_cache=None,
+                 batch_size=AI_BATCH_SIZE, max_side=AI_MAX_SIDE):
+        self.client = client
+        self.model = model
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.answer_cache = answer_cache
+        self.batch_size = max(1, batch_size)
+        self.max_side = max_side
+
+    def _generate(self, contents, config=None):
+        """
+        generate_content with retries; raises the last error once they are exhausted.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.client.models.generate_content(model=self.model, contents=contents, config=config)
+            except Exception as e:
+                status = getattr(e, "code", None)
+                if attempt == self.max_retries or (status is not None and status not in RETRYABLE_STATUS):
+                    raise
+                # Full jitter keeps parallel retries from hitting the server in lockstep
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def _part(self, image_path):
+        from google.genai import types
+        data, mime_type = encode_image(image_path, self.max_side)
+        return types.Part.from_bytes(data=data, mime_type=mime_type)
+
+    def _remember(self, content_hash, query, answer):
+        if answer and content_hash and self.answer_cache is not None:
+            self.answer_cache.put(content_hash, query, self.model, answer)
+
+    ## SINGLE IMAGE ##
+    def _ask_remote(self, image_path, query, content_hash=None):
+        """
+        {"image_path", "answer"} with a lowercase yes/no answer, or
+        {"image_path", "error"} once retries are exhausted.
+        """
+        try:
+            response = self._generate([self._part(image_path), PROMPT.format(query=query)])
+        except Exception as e:
+            print(f"❌ Error analyzing {image_path}: {e}")
+            return {"image_path": image_path, "error": str(e)}
+        answer = (response.text or "").strip().lower()
+        self._remember(content_hash, query, answer)
+        return {"image_path": image_path, "answer": answer}
+
+    ## BATCHES ##
+    def ask_batch(self, image_paths, query, content_hashes=None):
+        """
+        One request for several photos, answered as a JSON array. Returns
+        one _ask_remote()-style result per photo, in order; photos missing
+        from the reply get an error.
+        """
+        content_hashes = content_hashes or {}
+        if len(image_paths) == 1:
+            return [self._ask_remote(image_paths[0], query, content_hashes.get(image_paths[0]))]
+
+        try:
+            contents = []
+            for number, path in enumerate(image_paths, 1):
+                contents += [f"Photo {number}:", self._part(path)]
+            contents.append(BATCH_PROMPT.format(query=query, count=len(image_paths)))
+            config = {"response_mime_type": "application/json"}
+            answers = parse_batch_answers(self._generate(contents, config).text, len(image_paths))
+        except Exception as e:
+            print(f"❌ Error analyzing a batch of {len(image_paths)} photos: {e}")
+            return [{"image_path": path, "error": str(e)} for path in image_paths]
+
+        results = []
+        for path, answer in zip(image_paths, answers):
+            if answer is None:
+                results.append({"image_path": path, "error": "no answer for this photo"})
+                continue
+            self._remember(content_hashes.get(path), query, answer)
+            results.append({"image_path": path, "answer": answer})
+        return results
+
+    ## CANDIDATES ##
+    def find_matches(self, image_paths, query, top_n=None, content_hashes=None):
+        """
+        Paths the model accepted, in candidate order: the first top_n
+        matches, or all of them for top_n=None. No new requests are sent once
+        top_n were accepted; requests still in flight for earlier candidates
+        are waited for, later ones are abandoned. content_hashes optionally
+        gives {path: hash} the caller already resolved.
+        """
+        # Cached answers are looked up in one pass and never reach the pool;
+        # hits and misses are recorded in fill() for candidates actually evaluated
+        hashes, known = {}, {}
+        if self.answer_cache is not None:
+            hashes = content_hashes if content_hashes is not None else indexed_hashes(image_paths)
+            known = self.answer_cache.get_many(hashes.values(), query, self.model, count=False)
+
+        accepted = {}
+        remaining = iter(enumerate(image_paths))
+        pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="ai-eval")
+        pending = {}
+
+        def submit(batch):
+            paths = [path for _, path in batch]
+            future = pool.submit(self.ask_batch, paths, query, {path: hashes.get(path) for path in paths})
+            pending[future] = [position for position, _ in batch]
+
+        def fill():
+            batch = []
+            for position, path in remaining:
+                answer = known.get(hashes.get(path))
+                if self.answer_cache is not None:
+                    self.answer_cache.record(hits=answer is not None, misses=answer is None)
+                if answer is not None:
+                    if answer == "yes":
+                        accepted[position] = path
+                        # Earlier candidates still waiting in batch are sent
+                        # below, since one of them may be a match too
+                        if top_n and len(accepted) >= top_n:
+                            break
+                    continue
+                batch.append((position, path))
+                if len(batch) == self.batch_size:
+                    submit(batch)
+                    batch = []
+                    if len(pending) >= self.max_in_flight:
+                        return
+            if batch:
+                submit(batch)
+
+        def settled():
+            # top_n accepted is only final once no pending batch holds an
+            # earlier candidate, so the answer doesn't depend on which
+            # request finished first
+            if not top_n or len(accepted) < top_n:
+                return False
+            cutoff = sorted(accepted)[top_n - 1]
+            return all(min(positions) > cutoff for positions in pending.values())
+
+        try:
+            fill()
+            while pending and not settled():
+                completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    positions = pending.pop(future)
+                    for position, result in zip(positions, future.result()):
+                        if result.get("answer", "").startswith("yes"):
+                            accepted[position] = image_paths[position]
+                # Unsent candidates all come after the cutoff, so they can't change the result
+                if not top_n or len(accepted) < top_n:
+                    fill()
+        finally:
+            # Don't hold the response for requests whose answers are no longer needed
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        ordered = [accepted[position] for position in sorted(accepted)]
+        return ordered[:top_n] if top_n else ordered
+
+## STUB SERVER ##
+def run_stub_server(port=8089, latency=0.2, failure_rate=0.0, yes_rate=0.3):
+    """
+    Local stand-in for the Gemini generateContent endpoint, for testing the
+    evaluator without network access or quota. Answers are derived from a
+    hash of each image's bytes, so they are stable across runs, and batch
+    requests asking for JSON get a per-photo array. failure_rate
+    returns random 503s to exercise retries. Point the app at it with
+    GEMINI_BASE_URL=http://127.0.0.1:<port>.
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            time.sleep(latency)
+            if not re.search(r"/models/[^/]+:generateContent$", self.path.split("?")[0]):
+                return self._reply(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+            if random.random() < failure_rate:
+                return self._reply(503, {"error": {"code": 503, "message": "Overloaded", "status": "UNAVAILABLE"}})
+
+            images = [
+                base64.b64decode(part["inlineData"]["data"])
+                for content in body.get("contents", [])
+                for part in content.get("parts", [])
+                if "inlineData" in part
+            ]
+            answers = ["yes" if hashlib.sha256(image).digest()[0] < 256 * yes_rate else "no" for image in images]
+            if body.get("generationConfig", {}).get("responseMimeType") == "application/json":
+                answer = json.dumps([{"photo": number, "answer": a} for number, a in enumerate(answers, 1)])
+            else:
+                answer = answers[0] if answers else "no"
+            self._reply(200, {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": answer}]}, "finishReason": "STOP"}],
+            })
+
+        def _reply(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    print(f"🤖 Stub Gemini server on http://127.0.0.1:{port}")
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+## SELF-TEST ##
+class StubClient:
+    """
+    In-process stand-in for genai.Client: answers "yes" for the photos in
+    matches and records every photo it was asked about. Paired with an
+    evaluator whose _part returns ("photo", path), so no image is read.
+    """
+
+    def __init__(self, matches):
+        self.matches = set(matches)
+        self.asked = []
+        self.models = self
+
+    def generate_content(self, model, contents, config=None):
+        paths = [part[1] for part in contents if isinstance(part, tuple)]
+        self.asked += paths
+        answers = ["yes" if path in self.matches else "no" for path in paths]
+        if config:
+            text = json.dumps([{"photo": number, "answer": a} for number, a in enumerate(answers, 1)])
+        else:
+            text = answers[0]
+        return type("Response", (), {"text": text})()
+
+# (candidates, top_n, batch size, model matches, cached {path: answer}, expected result)
+FIND_MATCHES_EXAMPLES = [
+    (["A", "B", "C"], 1, 8, {"A", "B"}, {}, ["A"]),
+    # A cached "yes" for B must not skip A, which comes first and isn't cached
+    (["A", "B", "C"], 1, 8, {"A", "B"}, {"B": "yes"}, ["A"]),
+    (["A", "B", "C"], 1, 1, {"A", "B"}, {"B": "yes"}, ["A"]),
+    (["A", "B", "C"], 1, 8, {"B"}, {"B": "yes"}, ["B"]),
+    (["A", "B", "C", "D", "E"], 2, 2, {"A", "C", "D"}, {"C": "yes", "D": "yes"}, ["A", "C"]),
+    (["A", "B", "C"], None, 8, {"A", "C"}, {"A": "yes", "B": "no"}, ["A", "C"]),
+]
+
+def run_self_test():
+    import tempfile
+    from ai_answer_cache import AnswerCache
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, (candidates, top_n, batch_size, matches, cached, expected) in enumerate(FIND_MATCHES_EXAMPLES):
+            client = StubClient(matches)
+            answer_cache = AnswerCache(db_path=os.path.join(tmp, f"answers{i}.db"))
+            evaluator = AIEvaluator(client, model="stub", answer_cache=answer_cache, batch_size=batch_size, max_in_flight=2)
+            evaluator._part = lambda path: ("photo", path)
+            hashes = {path: f"hash-{path}" for path in candidates}
+            for path, answer in cached.items():
+                answer_cache.put(hashes[path], "query", "stub", answer)
+            got = evaluator.find_matches(candidates, "query", top_n, content_hashes=hashes)
+            if got != expected:
+                failures += 1
+                print(f"❌ {candidates} top {top_n}, cached {cached}: expected {expected}, got {got} (asked {client.asked})")
+    print(f"✅ {len(FIND_MATCHES_EXAMPLES) - failures}/{len(FIND_MATCHES_EXAMPLES)} find_matches examples pass")
+    return failures
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Local stub of the Gemini API, or a self-test of find_matches")
+    parser.add_argument("command", choices=["stub-server", "self-test"])
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--yes-rate", type=float, default=0.3, help="share of images answered with yes")
+    args = parser.parse_args()
+    if args.command == "self-test":
+        raise SystemExit(1 if run_self_test() else 0)
+    run_stub_server(args.port, args.latency, args.failure_rate, args.yes_rate)
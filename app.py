@@ -1,22 +1,37 @@
-import base64
-import io
+import hashlib
+import threading
 import time
 import uuid
-from PIL import Image
-from flask import Flask, request, jsonify, render_template,json
+from datetime import datetime, timezone
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context, json
 import os
-from deepface import DeepFace
-from google import genai
-from google.genai import types
-from sentiment_search_v2 import extract_query_info, filter_images_by_date, filter_images_by_emotion, filter_images_by_location
 from dotenv import load_dotenv
 
+load_dotenv()
+
+from emotion_cache import get_cache
+from ingestion import IngestionService, LIBRARY_FOLDERS
+from upload_store import UploadStore
+from thumbnails import get_thumbnail_store
+from image_index import scan_folder, sync_folder
+from ai_evaluator import AIEvaluator
+from model_registry import registry, get_model
+from ai_answer_cache import get_answer_cache
+from evaluation_log import EvaluationLog
+from sentiment_search_v2 import extract_query_info, extract_radius_km, filter_images_by_date, filter_images_by_emotion, filter_images_by_location, filter_images_by_face, rank_images_progressively, mentions_user, analyze_and_store, analyze_image, reverse_geocode
 
 app = Flask(__name__)
-UPLOAD_CACHE_FOLDER = "static/user_upload_cache"
-EVAL_LOG = "user_evaluation.jsonl"
-load_dotenv()
-os.makedirs(UPLOAD_CACHE_FOLDER, exist_ok=True)
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_UPLOAD_MB", "200")) * 1024 * 1024
+DEBUG = True
+# Where library ingestion runs: "app" (in this process, for the dev server),
+# "external" (a separate `python ingestion.py`, for multi-worker servers) or "off"
+INGESTION_MODE = os.getenv("INGESTION_MODE", "app")
+ingestion = None
+evaluator = None
+uploads = UploadStore()
+evaluations = EvaluationLog()
+PHOTOS_PER_PAGE = 48
+MAX_PHOTOS_PER_PAGE = 500
 
 @app.route('/')
 def home():
@@ -31,168 +46,237 @@ def query_processing():
         return process_query_ai(request)
     return process_query(request)
 
-def process_query_ai(request):
-    start = time.time()
-    client = genai.Client(api_key=os.getenv("GEMINI"))
-
-    data = request.json
-    text = data.get("query")
-    uploaded_photos = data.get("uploaded", [])
-    emotion_category, month, year, top_n, location = extract_query_info(text)
-
-
-    for f in os.listdir(UPLOAD_CACHE_FOLDER):
-        try:
-            os.remove(os.path.join(UPLOAD_CACHE_FOLDER, f))
-        except Exception as e:
-            print("⚠️ Error clearing cache:", e)
-
-    uploaded_image_paths = []
-    try:
-        for item in uploaded_photos:
-            base64_data = item.get("url", "").split(",")[-1]
-            img_bytes = base64.b64decode(base64_data)
-            img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-            img_path = os.path.join(UPLOAD_CACHE_FOLDER, f"{uuid.uuid4().hex}.jpg")
-            img.save(img_path)
-            uploaded_image_paths.append(img_path)
-    except Exception as e:
-        print("⚠️ Error saving uploaded images:", e)
-
-    static_folder = "static/images_v2"
-    static_image_paths = [
-        os.path.join(static_folder, f)
-        for f in os.listdir(static_folder)
-        if f.lower().endswith((".jpg", ".jpeg", ".png"))
-    ]
-
-    def evaluate_image(image_path):
-        prompt = f"""
-        Given the user's request: {text}
-        Does the following photo fulfill the user's request?
-        Answer only with 'yes' or 'no'.
-        """
+@app.route('/uploads', methods=['POST'])
+def upload_photos():
+    """
+    Multipart upload of one or more photos (field "images"). Files are
+    streamed to the session's upload folder as-is; the response gives the
+    session ID and an ID per photo for later queries to reference.
+    """
+    session_id = uploads.session(request.form.get("session"))
+    files = request.files.getlist("images")
+    # Reject the whole request before saving anything, so no file is stored without the client getting its ID
+    for file in files:
         try:
-            with open(image_path, "rb") as img_file:
-                image_bytes = img_file.read()
-
-            response = client.models.generate_content(
-                model="gemini-1.5-flash-latest",
-                contents=[types.Part.from_bytes(data = image_bytes, mime_type = "image/jpeg"), prompt]
-            )
-            return {
-                "image_path": image_path,
-                "answer": response.text.strip().lower()
-            }
-        except Exception as e:
-            print(f"❌ Error analyzing {image_path}: {e}")
-            return {
-                "image_path": image_path,
-                "error": str(e)
-            }
-
-    evaluated_uploaded = [evaluate_image(path) for path in uploaded_image_paths]
-    evaluated_static = [evaluate_image(path) for path in static_image_paths]
-
-    top_emotion_results = (evaluated_uploaded+evaluated_static)[0:top_n]
-    print(top_emotion_results)
-
-    results= []
-
-    for img_response in top_emotion_results:
-        if img_response["answer"] == "yes":
-            results.append({
-                "image_url": "/" + img_response["image_path"].replace("\\", "/"),
-            })
+            uploads.check_filename(file.filename)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    saved = []
+    for file in files:
+        upload_id = uploads.save(session_id, file.stream, file.filename)
+        saved.append({"id": upload_id, "url": "/" + uploads.path(session_id, upload_id).replace("\\", "/")})
+    if not saved:
+        return jsonify({"error": "No image file provided"}), 400
+    # Results stay cached under their hash; only the path -> hash rows go
+    get_cache().forget_paths(uploads.prune())
+    return jsonify({"session": session_id, "uploads": saved})
+
+@app.route('/uploads/<session_id>/<upload_id>', methods=['DELETE'])
+def delete_upload(session_id, upload_id):
+    path = uploads.delete(session_id, upload_id)
+    if not path:
+        return jsonify({"error": "Unknown upload"}), 404
+    # Emotion results stay cached under the image's content hash
+    get_cache().forget_paths([path])
+    return jsonify({"status": "ok"})
 
-    end = time.time()
+def filter_candidates(session_id, upload_ids, location, radius_km, date_range):
+    """
+    Uploaded and library photos that pass the location and date filters.
+    Returns (matching uploads, all matching photos, whether the library is
+    precomputed by ingestion).
+    """
+    uploaded_paths = uploads.paths(session_id, upload_ids)
+    print("uploaded: ", len(uploaded_paths))
+
+    filtered_images_uploaded = []
+    if uploaded_paths:
+        # The session folder is indexed like any library folder; only new uploads are read
+        session_folder = uploads.folder(session_id)
+        uploads.touch(session_id)
+        sync_folder(session_folder, reverse_geocode)
+        location_filter_uploaded = filter_images_by_location(session_folder, location, radius_km, sync=False)
+        data_filter_uploaded = filter_images_by_date(session_folder, date_range, sync=False)
+        filtered_images_uploaded = list(set(location_filter_uploaded) & set(data_filter_uploaded) & set(uploaded_paths))
+
+    result_image = list(filtered_images_uploaded)
+    print('resulted upload image: ',len(result_image))
 
-    return jsonify({
+    # With ingestion running the library is already indexed and scored, so
+    # the query only reads stored data; uploads are still analyzed inline
+    precomputed = ingestion is not None or INGESTION_MODE == "external"
+    for folder in LIBRARY_FOLDERS:
+        # Without ingestion, one sync per folder serves both filters
+        if not precomputed:
+            sync_folder(folder, reverse_geocode)
+        location_filter = filter_images_by_location(folder, location, radius_km, sync=False)
+        date_filter = filter_images_by_date(folder, date_range, sync=False)
+        result_image += list(set(location_filter) & set(date_filter))
+
+    return filtered_images_uploaded, result_image, precomputed
+
+def get_evaluator():
+    global evaluator
+    if evaluator is None:
+        evaluator = AIEvaluator(get_model("genai_client"), answer_cache=get_answer_cache())
+    return evaluator
+
+def describe_query(emotion_category, date_range, top_n):
+    return {
         "emotion": emotion_category,
-        "month": month,
-        "year": year,
+        "date_range": date_range.label if date_range else None,
         "top_n": top_n,
-        "time_elapsed":round(end-start,2),
-        "results": results
-    })
+    }
 
+def format_results(scored_images):
+    thumbnails = get_thumbnail_store().urls([img["path"] for img in scored_images])
+    return [{
+        "image_url": "/" + img['path'].replace("\\", "/"),
+        "thumbnails": thumbnails.get(img["path"], {}),
+        "score": img["score"],
+        "dominant": img["dominant"]
+    } for img in scored_images]
 
+def process_query_ai(request):
+    return jsonify(search_ai(request.json))
 
-def process_query(request):
+def search_ai(data):
     start = time.time()
-    for f in os.listdir(UPLOAD_CACHE_FOLDER):
-        try:
-            file_path = os.path.join(UPLOAD_CACHE_FOLDER, f)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-        except Exception as e:
-            print(f"⚠️ Error deleting {file_path}: {e}")
 
-    data = request.json
     text = data.get("query")
-    uploaded_photos = data.get("uploaded", [])
-    print("uploaded: ", len(uploaded_photos))
-
-    result_image = []
-
-    try:
-        for item in uploaded_photos:
-            base64_data = item.get("url", "").split(",")[-1]
-            img_bytes = base64.b64decode(base64_data)
-            img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-            img_path = os.path.join(UPLOAD_CACHE_FOLDER, f"{uuid.uuid4().hex}.jpg")
-            img.save(img_path)
-
-            # result_image.append(img_path)
-    except Exception as e:
-        print("Error processing uploaded images: ", e)
-
-
-    emotion_category, month, year, top_n, location = extract_query_info(text)
-
-    location_filter_uploaded = filter_images_by_location(UPLOAD_CACHE_FOLDER,location)
-    data_filter_uploaded = filter_images_by_date(UPLOAD_CACHE_FOLDER,month,year)
-    filtered_images_uploaded = list(set(location_filter_uploaded) & set(data_filter_uploaded))
+    emotion_category, date_range, top_n, location = extract_query_info(text)
+
+    filtered_images_uploaded, candidates, _ = filter_candidates(
+        data.get("session"), data.get("uploaded", []), location, extract_radius_km(text), date_range
+    )
+
+    # Photos the local emotion ranking favours are asked about first, so the
+    # evaluator reaches top_n sooner; the rest (e.g. photos without faces or
+    # stored scores) follow, since the model may still judge them a match.
+    # The ranking only orders candidates, so library photos are never
+    # analyzed for it, whatever the ingestion mode
+    ranked = [img["path"] for img in filter_images_by_emotion(
+        candidates, emotion_category, None, analyze_only=filtered_images_uploaded
+    )]
+    ranked_set = set(ranked)
+    ordered = ranked + [path for path in candidates if path not in ranked_set]
+    print(f"🤖 Asking the model about up to {len(ordered)} photos")
+
+    matches = get_evaluator().find_matches(ordered, text, top_n)
+    thumbnails = get_thumbnail_store().urls(matches)
+    results = [{"image_url": "/" + path.replace("\\", "/"), "thumbnails": thumbnails.get(path, {})} for path in matches]
 
-    result_image += filtered_images_uploaded
-    print('resulted upload image: ',len(result_image))
+    end = time.time()
 
-    folder = "static/images_v2"
-    location_filter = filter_images_by_location(folder,location)
-    date_filter = filter_images_by_date(folder, month, year)
-    filtered_images = list(set(location_filter) & set(date_filter))
+    return {
+        **describe_query(emotion_category, date_range, top_n),
+        "time_elapsed":round(end-start,2),
+        "results": results
+    }
 
-    result_image += filtered_images
+def prepare_search(data, emotion_category, date_range, location):
+    """
+    Candidates and ranking inputs for an emotion search: (candidates,
+    emotion, analyze_only, face template embedding or None). A "captured
+    emotion" query takes its emotion from the face template.
+    """
+    text = data.get("query")
+    filtered_images_uploaded, result_image, precomputed = filter_candidates(
+        data.get("session"), data.get("uploaded", []), location, extract_radius_km(text), date_range
+    )
 
     search_with_user = "captured emotion" in text.lower()
     face_template_path = "user_face_templates/face_template.jpg"
-    use_face_template = search_with_user and os.path.exists(face_template_path)
+    search_for_user = mentions_user(text)
+    use_face_template = (search_with_user or search_for_user) and os.path.exists(face_template_path)
+    template_faces = analyze_image(face_template_path) if use_face_template else []
 
-    if use_face_template:
+    if search_with_user and template_faces:
         print("📸 Using face template for emotion matching...")
-        result = DeepFace.analyze(img_path=face_template_path, actions=["emotion"], enforce_detection=False)
-        emotion_category = result[0]["dominant_emotion"].lower()
+        emotion_category = template_faces[0]["dominant_emotion"].lower()
         print("👀 Detected Emotion from User: ",emotion_category)
 
-    top_emotion_results = filter_images_by_emotion(result_image, emotion_category, top_n)
+    template_embedding = None
+    if search_for_user and template_faces:
+        print("🧑 Only keeping photos where the face template's person appears...")
+        template_embedding = template_faces[0]["embedding"]
 
-    results = [{
-        "image_url": "/" + img['path'].replace("\\", "/"),
-        "score": img["score"],
-        "dominant": img["dominant"]
-    } for img in top_emotion_results]
+    analyze_only = filtered_images_uploaded if precomputed else None
+    return result_image, emotion_category, analyze_only, template_embedding
+
+def process_query(request):
+    start = time.time()
+
+    data = request.json
+    emotion_category, date_range, top_n, location = extract_query_info(data.get("query"))
+    result_image, emotion_category, analyze_only, template_embedding = prepare_search(
+        data, emotion_category, date_range, location
+    )
+
+    if template_embedding is not None:
+        top_emotion_results = filter_images_by_face(
+            result_image, template_embedding, emotion_category, top_n, analyze_only=analyze_only
+        )
+    else:
+        top_emotion_results = filter_images_by_emotion(
+            result_image, emotion_category, top_n, analyze_only=analyze_only
+        )
 
     end = time.time()
 
     return jsonify({
-        "emotion": emotion_category,
-        "month": month,
-        "year": year,
-        "top_n": top_n,
+        **describe_query(emotion_category, date_range, top_n),
         "time_elapsed":round(end-start,2),
-        "results": results
+        "results": format_results(top_emotion_results)
     })
 
+@app.route('/process_query_stream', methods=['POST'])
+def query_streaming():
+    """
+    /process_query as newline-delimited JSON events: "query" with the parsed
+    query, "results" with rankings from stored scores that are refined as
+    the remaining photos are analyzed, and "done" with the final ranking and
+    timing. AI searches go straight from "query" to "done". A search that
+    fails partway ends with an "error" event instead of "done".
+    """
+    data = request.json
+
+    def event(name, **body):
+        return json.dumps({"event": name, **body}) + "\n"
+
+    def events():
+        try:
+            yield from search_events()
+        except Exception as e:
+            print(f"❌ Streamed search failed: {e}")
+            yield event("error", error=str(e))
+
+    def search_events():
+        start = time.time()
+        emotion_category, date_range, top_n, location = extract_query_info(data.get("query"))
+        yield event("query", **describe_query(emotion_category, date_range, top_n))
+
+        if data.get("useAI"):
+            yield event("done", **search_ai(data))
+            return
+
+        result_image, emotion_category, analyze_only, template_embedding = prepare_search(
+            data, emotion_category, date_range, location
+        )
+        ranked = []
+        for ranked, remaining in rank_images_progressively(
+            result_image, emotion_category, top_n, analyze_only=analyze_only, template_embedding=template_embedding
+        ):
+            if remaining:
+                yield event("results", emotion=emotion_category, remaining=remaining, results=format_results(ranked))
+
+        yield event("done", **describe_query(emotion_category, date_range, top_n),
+                    time_elapsed=round(time.time() - start, 2), results=format_results(ranked))
+
+    # Proxies such as nginx would otherwise hold events back until the response ends
+    return Response(stream_with_context(events()), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 UPLOAD_FOLDER = "user_face_templates"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
@@ -203,7 +287,10 @@ def upload_face_template():
 
     file = request.files["image"]
     file_path = os.path.join(UPLOAD_FOLDER, "face_template.jpg")
-    file.save(file_path)
+    # Write aside and rename, so a concurrent query never reads a half-written template
+    partial_path = f"{file_path}.{uuid.uuid4().hex}.part"
+    file.save(partial_path)
+    os.replace(partial_path, file_path)
     return jsonify({"status": "success", "saved_to": file_path})
 
 @app.route("/evaluate_result", methods=["POST"])
@@ -219,43 +306,117 @@ def evaluate_result():
         "met_expectation": met
     }
 
-    with open(EVAL_LOG, "a") as f:
-        f.write(json.dumps(log_entry) + "\n")
+    # Buffered and counted in memory; the log writes it to disk shortly after
+    evaluations.record(log_entry)
 
     return jsonify({"status": "ok"})
 
 @app.route("/get_evaluation_summary")
 def evaluation_percent():
-    matches = 0
-    total = 0
-    try:
-        with open("user_evaluation.jsonl", "r") as f:
-            for line in f:
-                try:
-                    entry = json.loads(line)
-                    total += 1
-                    if entry.get("met_expectation"):
-                        matches += 1
-                except json.JSONDecodeError:
-                    continue
-        percent = int((matches / total) * 100) if total > 0 else 0
-    except FileNotFoundError:
-        percent = 0
-
-    return jsonify({"percent": percent, "correct": matches, "total": total})
+    return jsonify(evaluations.summary())
+
+_library_listing = {"stamp": None, "paths": [], "last_modified": 0}
+_library_listing_lock = threading.Lock()
+
+def library_photos():
+    """
+    (sorted library photo paths, listing stamp, last modified time). The
+    stamp covers every photo's mtime and size as well as the folders', so
+    it changes when a photo is added, removed, renamed or overwritten.
+    """
+    files = {}
+    folder_mtimes = []
+    for folder in LIBRARY_FOLDERS:
+        if os.path.isdir(folder):
+            folder_mtimes.append(os.stat(folder).st_mtime)
+            files.update(scan_folder(folder))
+    listing = sorted(files.items())
+    stamp = hashlib.sha1(repr(listing).encode()).hexdigest()
+    with _library_listing_lock:
+        if _library_listing["stamp"] != stamp:
+            _library_listing["paths"] = [path for path, _ in listing]
+            _library_listing["last_modified"] = max([mtime for mtime, _ in files.values()] + folder_mtimes, default=0)
+            _library_listing["stamp"] = stamp
+        return _library_listing["paths"], stamp, _library_listing["last_modified"]
 
 @app.route('/all_photos')
 def all_photos():
-    folder = 'static/images_v2'
-    image_files = [
-        os.path.join('/', folder, f).replace('\\', '/')
-        for f in os.listdir(folder)
-        if f.lower().endswith(('.jpg', '.jpeg', '.png'))
-    ]
-    return jsonify(image_files)
+    paths, _, _ = library_photos()
+    return jsonify(["/" + path.replace('\\', '/') for path in paths])
+
+@app.route('/photos')
+def list_photos():
+    """
+    One page of the library with thumbnail URLs (?page=1&per_page=48).
+    Answers 304 when the client's ETag or Last-Modified is still current,
+    before any thumbnail work is done. Photos without thumbnails yet are
+    listed with their original URL while the thumbnails are made.
+    """
+    page = max(1, request.args.get("page", 1, type=int))
+    per_page = min(max(1, request.args.get("per_page", PHOTOS_PER_PAGE, type=int)), MAX_PHOTOS_PER_PAGE)
+    paths, stamp, modified = library_photos()
+    etag = hashlib.sha1(f"{stamp}:{page}:{per_page}".encode()).hexdigest()
+    last_modified = datetime.fromtimestamp(modified, timezone.utc).replace(microsecond=0)
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = request.if_modified_since is not None and request.if_modified_since >= last_modified
+    if not_modified:
+        response = Response(status=304)
+    else:
+        page_paths = paths[(page - 1) * per_page:page * per_page]
+        thumbnails = get_thumbnail_store().urls(page_paths)
+        photos = [
+            {"image_url": "/" + path.replace('\\', '/'), "thumbnails": thumbnails.get(path, {})}
+            for path in page_paths
+        ]
+        response = jsonify({"page": page, "per_page": per_page, "total": len(paths), "photos": photos})
+        # A page still pointing at originals isn't cached, so the next
+        # visit picks up the thumbnails once they're made
+        if any(photo["image_url"] in photo["thumbnails"].values() for photo in photos):
+            response.cache_control.no_store = True
+            return response
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Cached copies must be revalidated, which costs a 304 when nothing changed
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/ai_cache_stats')
+def ai_cache_stats():
+    return jsonify(get_answer_cache().stats())
+
+@app.route('/ready')
+def ready():
+    """
+    200 once every required model is loaded and warmed up, 503 before;
+    either way the body has per-model load and warm-up times.
+    """
+    status = registry.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route('/ingestion_status')
+def ingestion_status():
+    if ingestion is None:
+        return jsonify({"running": False})
+    return jsonify({"running": True, **ingestion.status()})
+
+def start_ingestion():
+    global ingestion
+    ingestion = IngestionService(analyze_and_store, describe_location=reverse_geocode).start()
+
+# WSGI servers import this module once per worker; the dev server warms up below
+if __name__ != "__main__":
+    registry.start_warm_up()
 
 if __name__ == "__main__":
     # CLEAR EVALUATION LOG FILE WHEN THE APP STARTS
-    with open(EVAL_LOG, "w") as f:
-        f.truncate()
-    app.run(debug=True)
+    evaluations.reset()
+    # With the debug reloader only the child process (WERKZEUG_RUN_MAIN) serves requests
+    serving = not DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+    if serving:
+        registry.start_warm_up()
+    if INGESTION_MODE == "app" and serving:
+        start_ingestion()
+    app.run(debug=DEBUG, threaded=True)
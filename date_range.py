@@ -0,0 +1,202 @@
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+MONTHS = [
+    "january", "february", "march", "april", "may", "june",
+    "july", "august", "september", "october", "november", "december"
+]
+# Season -> (first month, number of months)
+SEASONS = {
+    "spring": (3, 3),
+    "summer": (6, 3),
+    "fall": (9, 3),
+    "autumn": (9, 3),
+    "winter": (12, 3),
+}
+NUMBER_WORDS = {
+    "a": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10
+}
+
+MONTH_PATTERN = "|".join(MONTHS)
+YEAR_PATTERN = r"(?:20\d{2}|19\d{2})"
+
+def add_months(date, count):
+    total = date.year * 12 + date.month - 1 + count
+    return date.replace(year=total // 12, month=total % 12 + 1, day=1)
+
+def month_number(name):
+    return MONTHS.index(name) + 1
+
+class DateRange(namedtuple("DateRange", ["start", "end", "recurring", "label"])):
+    """
+    Half-open [start, end) capture window. When recurring is (first_month,
+    month_count) the window repeats every year instead, e.g. "summer" with
+    no year given.
+    """
+
+    def intervals(self, first_year, last_year):
+        if not self.recurring:
+            return [(self.start, self.end)]
+        first_month, month_count = self.recurring
+        # Start a year early so windows wrapping the new year (winter) are covered
+        return [
+            (datetime(year, first_month, 1), add_months(datetime(year, first_month, 1), month_count))
+            for year in range(first_year - 1, last_year + 1)
+        ]
+
+def _month_span(first_month, last_month, year, label):
+    month_count = (last_month - first_month) % 12 + 1
+    if year is None:
+        return DateRange(None, None, (first_month, month_count), label)
+    start = datetime(year, first_month, 1)
+    if last_month < first_month:
+        # "between november and february 2024" ends in the named year
+        start = datetime(year - 1, first_month, 1)
+    return DateRange(start, add_months(start, month_count), None, label)
+
+def _relative_range(text, today):
+    day_start = datetime(today.year, today.month, today.day)
+    tomorrow = day_start + timedelta(days=1)
+
+    if re.search(r"\btoday\b", text):
+        return DateRange(day_start, tomorrow, None, "today")
+    if re.search(r"\byesterday\b", text):
+        return DateRange(day_start - timedelta(days=1), day_start, None, "yesterday")
+
+    # Calendar periods: "last week" is the previous Monday-Sunday
+    match = re.search(r"\b(this|last)\s+(week|month|year)\b", text)
+    if match:
+        offset = -1 if match.group(1) == "last" else 0
+        unit = match.group(2)
+        if unit == "week":
+            start = day_start - timedelta(days=day_start.weekday()) + timedelta(weeks=offset)
+            end = start + timedelta(weeks=1)
+        elif unit == "month":
+            start = add_months(day_start, offset)
+            end = add_months(start, 1)
+        else:
+            start = datetime(today.year + offset, 1, 1)
+            end = datetime(today.year + offset + 1, 1, 1)
+        return DateRange(start, end, None, f"{match.group(1)} {unit}")
+
+    # Rolling windows ending today: "past week", "last 3 days"
+    match = re.search(r"\b(?:last|past)\s+(?:(\d+|" + "|".join(NUMBER_WORDS) + r")\s+)?(day|week|month|year)s?\b", text)
+    if match:
+        amount = match.group(1) or "1"
+        amount = int(amount) if amount.isdigit() else NUMBER_WORDS[amount]
+        unit = match.group(2)
+        if unit == "day":
+            start = tomorrow - timedelta(days=amount)
+        elif unit == "week":
+            start = tomorrow - timedelta(weeks=amount)
+        elif unit == "month":
+            start = add_months(day_start, -amount).replace(day=min(today.day, 28))
+        else:
+            start = day_start.replace(year=today.year - amount, day=min(today.day, 28))
+        return DateRange(start, tomorrow, None, f"past {amount} {unit}" + ("s" if amount > 1 else ""))
+    return None
+
+def _relative_season(relative, season, today):
+    """
+    "last summer" is the most recent summer that is already over; "this
+    summer" is the one in progress, or else the one starting this year.
+    """
+    first_month, month_count = SEASONS[season]
+    day_start = datetime(today.year, today.month, today.day)
+    # Winter starts in December, so this year's winter may have begun last year
+    windows = [
+        (start, add_months(start, month_count))
+        for start in (datetime(year, first_month, 1) for year in range(today.year, today.year - 3, -1))
+    ]
+    if relative == "last":
+        start, end = next(window for window in windows if window[1] <= day_start)
+    else:
+        start, end = next((window for window in windows if window[0] <= day_start < window[1]), windows[0])
+    return DateRange(start, end, None, f"{relative} {season}")
+
+def extract_date_range(text, today=None):
+    """
+    Parse the timeframe of a query into a DateRange, or None when the query
+    does not mention one.
+    """
+    text = text.lower()
+    today = today or datetime.now()
+
+    relative = _relative_range(text, today)
+    if relative:
+        return relative
+
+    year_match = re.search(r"\b(" + YEAR_PATTERN + r")\b", text)
+    year = int(year_match.group(1)) if year_match else None
+
+    # "between march and may 2024", "from march 2023 to may 2024", "from march to may"
+    match = re.search(
+        r"\b(?:between|from)\s+(" + MONTH_PATTERN + r")(?:\s+(?:of\s+)?(" + YEAR_PATTERN + r"))?"
+        r"\s+(?:and|to|until|through|-)\s+(" + MONTH_PATTERN + r")(?:\s+(?:of\s+)?(" + YEAR_PATTERN + r"))?\b", text)
+    if match:
+        first, first_year, last, last_year = match.groups()
+        if first_year:
+            first_year = int(first_year)
+            start = datetime(first_year, month_number(first), 1)
+            if last_year:
+                last_year = int(last_year)
+            else:
+                # "from november 2023 to february" runs into the next year
+                last_year = first_year + (1 if month_number(last) < month_number(first) else 0)
+            end = add_months(datetime(last_year, month_number(last), 1), 1)
+            if end > start:
+                return DateRange(start, end, None, f"{first} {first_year} - {last} {last_year}")
+        span_year = int(last_year) if last_year else year
+        label = f"{first} - {last}" + (f" {span_year}" if span_year else "")
+        return _month_span(month_number(first), month_number(last), span_year, label)
+
+    match = re.search(r"\b(?:(last|this)\s+)?(" + "|".join(SEASONS) + r")\b", text)
+    if match:
+        relative, season = match.groups()
+        first_month, month_count = SEASONS[season]
+        if year is None and relative:
+            return _relative_season(relative, season, today)
+        label = season + (f" {year}" if year else "")
+        if year is None:
+            return DateRange(None, None, (first_month, month_count), label)
+        start = datetime(year, first_month, 1)
+        return DateRange(start, add_months(start, month_count), None, label)
+
+    month_match = re.search(r"\b(" + MONTH_PATTERN + r")\b", text)
+    if month_match:
+        month = month_number(month_match.group(1))
+        label = month_match.group(1) + (f" {year}" if year else "")
+        return _month_span(month, month, year, label)
+
+    if year:
+        return DateRange(datetime(year, 1, 1), datetime(year + 1, 1, 1), None, str(year))
+    return None
+
+## EXAMPLES ##
+# (query, today, expected (start, end) or recurring window); run `python date_range.py` to check them
+EXAMPLES = [
+    ("between march and may 2024", datetime(2025, 1, 10), (datetime(2024, 3, 1), datetime(2024, 6, 1))),
+    ("between march 2023 and may 2024", datetime(2025, 1, 10), (datetime(2023, 3, 1), datetime(2024, 6, 1))),
+    ("from november 2023 to february", datetime(2025, 1, 10), (datetime(2023, 11, 1), datetime(2024, 3, 1))),
+    ("between november and february 2024", datetime(2025, 1, 10), (datetime(2023, 11, 1), datetime(2024, 3, 1))),
+    ("from march to may", datetime(2025, 1, 10), (3, 3)),
+    ("summer 2023", datetime(2025, 1, 10), (datetime(2023, 6, 1), datetime(2023, 9, 1))),
+    ("summer", datetime(2025, 1, 10), (6, 3)),
+    ("last summer", datetime(2026, 10, 18), (datetime(2026, 6, 1), datetime(2026, 9, 1))),
+    ("last summer", datetime(2026, 7, 4), (datetime(2025, 6, 1), datetime(2025, 9, 1))),
+    ("last winter", datetime(2026, 1, 15), (datetime(2024, 12, 1), datetime(2025, 3, 1))),
+    ("this winter", datetime(2026, 1, 15), (datetime(2025, 12, 1), datetime(2026, 3, 1))),
+    ("march 2025", datetime(2025, 1, 10), (datetime(2025, 3, 1), datetime(2025, 4, 1))),
+]
+
+if __name__ == "__main__":
+    failures = 0
+    for query, today, expected in EXAMPLES:
+        date_range = extract_date_range(query, today)
+        got = date_range.recurring or (date_range.start, date_range.end)
+        if got != expected:
+            failures += 1
+            print(f"❌ {query!r} on {today:%Y-%m-%d}: expected {expected}, got {got}")
+    print(f"✅ {len(EXAMPLES) - failures}/{len(EXAMPLES)} date examples pass")
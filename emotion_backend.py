@@ -0,0 +1,408 @@
+import os
+import threading
+import numpy as np
+from PIL import Image, ImageOps
+from util import emotion_labels, file_content_hash, JPEG_FORMATS
+
+## CONFIGURATION ##
+# Which backend runs emotion inference in this process: deepface, onnx or stub
+EMOTION_BACKEND = os.getenv("EMOTION_BACKEND", "deepface")
+EMOTION_BATCH_SIZE = 32
+DETECTOR_BACKEND = "opencv"
+FACE_MODEL_NAME = "Facenet"
+# Longest side images are decoded to before face detection (0 = full resolution)
+INFERENCE_MAX_SIDE = int(os.getenv("INFERENCE_MAX_SIDE", "1024"))
+# Detector cascade: a Haar screen skips faceless photos and sends only
+# unclear ones to the stronger (slower) detector
+USE_DETECTOR_CASCADE = os.getenv("DETECTOR_CASCADE", "true").lower() == "true"
+STRONG_DETECTOR_BACKEND = os.getenv("STRONG_DETECTOR_BACKEND", "retinaface")
+SCREEN_MAX_SIDE = 640
+SCREEN_MIN_WINDOWS = 3        # fewer overlapping Haar windows than this = no face
+SCREEN_CONFIDENT_WINDOWS = 8  # at least this many = clear face, cheap detector is enough
+# Exported models for the ONNX backend (see export_onnx)
+EMOTION_ONNX_PATH = os.getenv("EMOTION_ONNX_PATH", "models/emotion.int8.onnx")
+FACENET_ONNX_PATH = os.getenv("FACENET_ONNX_PATH", "models/facenet.int8.onnx")
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 = onnxruntime default
+
+## DECODING ##
+def load_for_inference(image_path, max_side=None):
+    """
+    Decode an image for the face detector at reduced size. JPEGs use draft
+    mode, which lets libjpeg scale by 1/2, 1/4 or 1/8 during DCT decoding, so
+    a 48 MP photo never materializes at full resolution. EXIF orientation is
+    applied so faces are upright. Returns a BGR array, as DeepFace expects.
+    """
+    max_side = INFERENCE_MAX_SIDE if max_side is None else max_side
+    with Image.open(image_path) as img:
+        if max_side and img.format in JPEG_FORMATS:
+            img.draft("RGB", (max_side, max_side))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+    if max_side:
+        img.thumbnail((max_side, max_side))
+    return np.ascontiguousarray(np.asarray(img)[:, :, ::-1])
+
+## PREPROCESSING ##
+def preprocess_face(face):
+    """
+    Same preprocessing DeepFace.analyze applies before the emotion model:
+    RGB [0, 1] crop -> padded 224x224 BGR -> 48x48 grayscale.
+    """
+    import cv2
+    from deepface.modules import preprocessing
+    face = preprocessing.resize_image(img=face[:, :, ::-1], target_size=(224, 224))[0]
+    gray = cv2.cvtColor(face.astype(np.float32), cv2.COLOR_BGR2GRAY)
+    return np.expand_dims(cv2.resize(gray, (48, 48)), axis=-1)
+
+def preprocess_face_for_embedding(face, target_size):
+    """
+    Same preprocessing DeepFace.represent applies before the recognition
+    model: RGB [0, 1] crop -> padded BGR at the model's input size.
+    """
+    from deepface.modules import preprocessing
+    return preprocessing.resize_image(img=face[:, :, ::-1], target_size=target_size)[0]
+
+## DETECTOR CASCADE ##
+_screen_local = threading.local()
+
+def get_screen_cascades():
+    import cv2
+    # CascadeClassifier is not safe to share between threads
+    cascades = getattr(_screen_local, "cascades", None)
+    if cascades is None:
+        cascades = [
+            cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, name))
+            for name in ("haarcascade_frontalface_default.xml", "haarcascade_profileface.xml")
+        ]
+        _screen_local.cascades = cascades
+    return cascades
+
+def screen_faces(img):
+    """
+    First stage of the detector cascade: Haar cascades on a small grayscale
+    copy. Returns "face" when a detection is backed by many overlapping
+    windows, "ambiguous" for weak detections and "none" when nothing
+    face-like was found.
+    """
+    import cv2
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    scale = SCREEN_MAX_SIDE / max(gray.shape[:2])
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    gray = cv2.equalizeHist(gray)
+
+    strongest = 0
+    for cascade in get_screen_cascades():
+        _, windows = cascade.detectMultiScale2(gray, scaleFactor=1.1, minNeighbors=SCREEN_MIN_WINDOWS - 1,
+                                               minSize=(20, 20))
+        if len(windows):
+            strongest = max(strongest, int(np.max(windows)))
+        if strongest >= SCREEN_CONFIDENT_WINDOWS:
+            return "face"
+    return "ambiguous" if strongest else "none"
+
+# DeepFace shares one detector instance per backend across threads, and
+# neither OpenCV's detector nor the TensorFlow ones are safe to call concurrently
+_detector_lock = threading.Lock()
+
+def extract_faces(img, backend, keep_misses=False):
+    from deepface import DeepFace
+    with _detector_lock:
+        faces = DeepFace.extract_faces(img_path=img, detector_backend=backend, enforce_detection=False, align=True)
+    if keep_misses:
+        return faces
+    # With enforce_detection=False a miss comes back as the whole frame at confidence 0
+    return [face for face in faces if face["confidence"] > 0]
+
+def detect_faces(img):
+    """
+    Returns (faces, detector used). With the cascade on, images the screen
+    rejects come back as ([], "screened_out") without running a detector;
+    clear faces use DETECTOR_BACKEND, and ambiguous images, or clear ones
+    it misses, escalate to STRONG_DETECTOR_BACKEND.
+    """
+    if not USE_DETECTOR_CASCADE:
+        return extract_faces(img, DETECTOR_BACKEND, keep_misses=True), DETECTOR_BACKEND
+
+    screen = screen_faces(img)
+    if screen == "none":
+        return [], "screened_out"
+    if screen == "face":
+        faces = extract_faces(img, DETECTOR_BACKEND)
+        if faces:
+            return faces, DETECTOR_BACKEND
+    return extract_faces(img, STRONG_DETECTOR_BACKEND), STRONG_DETECTOR_BACKEND
+
+## BACKENDS ##
+class EmotionBackend:
+    """
+    Batch emotion inference. analyze(image_paths) returns {path: [face
+    results]} in the structure DeepFace.analyze produces (and the cache
+    stores), plus an "embedding" and "detector_backend" per face. Images
+    with no face map to []; images that could not be processed are left out.
+    If a detections dict is passed, it is filled with each image's detector
+    cascade outcome.
+    """
+
+    name = None
+
+    def analyze(self, image_paths, batch_size=None, max_side=None, detections=None):
+        raise NotImplementedError
+
+    def warm_up(self):
+        """
+        Load models ahead of the first request.
+        """
+
+class FaceModelBackend(EmotionBackend):
+    """
+    Detects faces per image, then sends every crop in a batch through the
+    emotion and recognition models in one forward pass each. Subclasses
+    supply the two models.
+    """
+
+    def predict_emotions(self, crops):
+        """
+        (N, 48, 48, 1) grayscale crops -> (N, 7) emotion probabilities.
+        """
+        raise NotImplementedError
+
+    def embed_faces(self, crops):
+        """
+        (N, H, W, 3) BGR crops at embedding_input_size -> (N, D) embeddings.
+        """
+        raise NotImplementedError
+
+    @property
+    def embedding_input_size(self):
+        raise NotImplementedError
+
+    def warm_up(self):
+        """
+        Run one blank input through the detectors and both models, so
+        detector weights are loaded and the first real batch doesn't pay
+        for graph setup.
+        """
+        blank = np.zeros((160, 160, 3), dtype=np.uint8)
+        if USE_DETECTOR_CASCADE:
+            extract_faces(blank, STRONG_DETECTOR_BACKEND)
+        extract_faces(blank, DETECTOR_BACKEND)
+        self.predict_emotions(np.zeros((1, 48, 48, 1), dtype=np.float32))
+        height, width = self.embedding_input_size
+        self.embed_faces(np.zeros((1, height, width, 3), dtype=np.float32))
+
+    def analyze(self, image_paths, batch_size=None, max_side=None, detections=None):
+        detections = {} if detections is None else detections
+        batch_size = batch_size or EMOTION_BATCH_SIZE
+        results = {}
+
+        for i in range(0, len(image_paths), batch_size):
+            crops, embed_crops, owners = [], [], []
+            for path in image_paths[i:i + batch_size]:
+                try:
+                    faces, backend = detect_faces(load_for_inference(path, max_side))
+                except Exception as e:
+                    print(f"❌ Error detecting faces in {path}: {e}")
+                    continue
+                results[path] = []
+                detections[path] = backend if faces or backend == "screened_out" else "no_face"
+                for face in faces:
+                    if face["face"].shape[0] == 0 or face["face"].shape[1] == 0:
+                        continue
+                    crops.append(preprocess_face(face["face"]))
+                    embed_crops.append(preprocess_face_for_embedding(face["face"], self.embedding_input_size))
+                    owners.append((path, face, backend))
+
+            if not crops:
+                continue
+
+            predictions = self.predict_emotions(np.stack(crops))
+            embeddings = self.embed_faces(np.stack(embed_crops))
+            for (path, face, backend), prediction, embedding in zip(owners, predictions, embeddings):
+                total = float(prediction.sum())
+                results[path].append({
+                    "emotion": {label: 100 * float(p) / total for label, p in zip(emotion_labels, prediction)},
+                    "dominant_emotion": emotion_labels[int(np.argmax(prediction))],
+                    "region": {k: int(v) for k, v in face["facial_area"].items() if isinstance(v, (int, np.integer))},
+                    "face_confidence": float(face["confidence"]),
+                    "embedding": [round(float(x), 6) for x in embedding],
+                    "detector_backend": backend,
+                })
+
+        if USE_DETECTOR_CASCADE:
+            # No face is a stored outcome, so later queries don't detect again
+            return results
+        # Without the cascade every image yields a crop; none means something failed
+        return {path: faces for path, faces in results.items() if faces}
+
+class DeepFaceBackend(FaceModelBackend):
+    """
+    DeepFace's Keras emotion and Facenet models.
+    """
+
+    name = "deepface"
+
+    def __init__(self):
+        # Serializes model building and Keras calls between request threads;
+        # decoding, detection screening and preprocessing still run in parallel
+        self._lock = threading.Lock()
+
+    def _model(self, task, model_name):
+        from deepface.modules import modeling
+        # DeepFace keeps built models in a process-wide cache
+        with self._lock:
+            return modeling.build_model(task=task, model_name=model_name)
+
+    def predict_emotions(self, crops):
+        model = self._model("facial_attribute", "Emotion").model
+        with self._lock:
+            return model.predict(crops, verbose=0)
+
+    def embed_faces(self, crops):
+        model = self._model("facial_recognition", FACE_MODEL_NAME).model
+        with self._lock:
+            return model(crops, training=False).numpy()
+
+    @property
+    def embedding_input_size(self):
+        return self._model("facial_recognition", FACE_MODEL_NAME).input_shape
+
+    def warm_up(self):
+        self._model("facial_attribute", "Emotion")
+        self._model("facial_recognition", FACE_MODEL_NAME)
+        super().warm_up()
+
+class OnnxBackend(FaceModelBackend):
+    """
+    The same two models exported to ONNX (int8-quantized by default) and run
+    with onnxruntime on the CPU, without TensorFlow in the inference path.
+    Face detection still goes through DeepFace. Create the model files with
+    `python emotion_backend.py export-onnx`.
+    """
+
+    name = "onnx"
+
+    def __init__(self, emotion_path=EMOTION_ONNX_PATH, facenet_path=FACENET_ONNX_PATH, threads=ONNX_THREADS):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The onnx emotion backend needs onnxruntime: pip install onnxruntime")
+        for path in (emotion_path, facenet_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"{path} not found; run `python emotion_backend.py export-onnx` first")
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.emotion = ort.InferenceSession(emotion_path, options, providers=["CPUExecutionProvider"])
+        self.facenet = ort.InferenceSession(facenet_path, options, providers=["CPUExecutionProvider"])
+
+    @staticmethod
+    def _run(session, batch):
+        return session.run(None, {session.get_inputs()[0].name: batch.astype(np.float32)})[0]
+
+    def predict_emotions(self, crops):
+        return self._run(self.emotion, crops)
+
+    def embed_faces(self, crops):
+        return self._run(self.facenet, crops)
+
+    @property
+    def embedding_input_size(self):
+        _, height, width, _ = self.facenet.get_inputs()[0].shape
+        return height, width
+
+class StubBackend(EmotionBackend):
+    """
+    Deterministic fake results derived from each file's content hash, for
+    measuring the rest of the pipeline without model weights. About one in
+    ten images has no face; the rest have one face with pseudo-random
+    emotion scores and embedding. Point EMOTION_STORE_DIR somewhere else
+    when using it, so fake scores don't end up in the real stores.
+    """
+
+    name = "stub"
+    embedding_size = 128
+
+    def analyze(self, image_paths, batch_size=None, max_side=None, detections=None):
+        detections = {} if detections is None else detections
+        results = {}
+        for path in image_paths:
+            try:
+                content_hash = file_content_hash(path)
+            except OSError as e:
+                print(f"❌ Error reading {path}: {e}")
+                continue
+            rng = np.random.default_rng(int(content_hash[:16], 16))
+            if rng.random() < 0.1:
+                results[path], detections[path] = [], "screened_out"
+                continue
+
+            scores = rng.dirichlet(np.ones(len(emotion_labels)))
+            embedding = rng.normal(size=self.embedding_size)
+            embedding /= np.linalg.norm(embedding)
+            results[path] = [{
+                "emotion": {label: 100 * float(p) for label, p in zip(emotion_labels, scores)},
+                "dominant_emotion": emotion_labels[int(np.argmax(scores))],
+                "region": {"x": 0, "y": 0, "w": 0, "h": 0},
+                "face_confidence": 1.0,
+                "embedding": [round(float(x), 6) for x in embedding],
+                "detector_backend": self.name,
+            }]
+            detections[path] = self.name
+        return results
+
+BACKENDS = {backend.name: backend for backend in (DeepFaceBackend, OnnxBackend, StubBackend)}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def set_backend(name):
+    """
+    Choose the backend for this process (overrides EMOTION_BACKEND).
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown emotion backend '{name}' (choose from {', '.join(BACKENDS)})")
+    with _backend_lock:
+        _backend = BACKENDS[name]()
+    return _backend
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = BACKENDS[EMOTION_BACKEND]()
+    return _backend
+
+## ONNX EXPORT ##
+def export_onnx(emotion_path=EMOTION_ONNX_PATH, facenet_path=FACENET_ONNX_PATH, quantize=True):
+    """
+    Convert DeepFace's Keras emotion and Facenet models to ONNX for the onnx
+    backend, with int8 dynamic quantization of the weights unless disabled.
+    Needs tf2onnx (and onnxruntime for quantization).
+    """
+    import tensorflow as tf
+    import tf2onnx
+    from deepface.modules import modeling
+
+    models = [
+        (modeling.build_model(task="facial_attribute", model_name="Emotion").model, emotion_path),
+        (modeling.build_model(task="facial_recognition", model_name=FACE_MODEL_NAME).model, facenet_path),
+    ]
+    for model, path in models:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        spec = (tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, name="input"),)
+        float_path = path + ".fp32" if quantize else path
+        tf2onnx.convert.from_keras(model, input_signature=spec, output_path=float_path)
+        if quantize:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(float_path, path, weight_type=QuantType.QInt8)
+            os.remove(float_path)
+        print(f"✅ Wrote {path}")
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ["export-onnx"]:
+        export_onnx(quantize="--no-quantize" not in sys.argv)
+    else:
+        print("Usage: python emotion_backend.py export-onnx [--no-quantize]")
@@ -0,0 +1,216 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from util import file_content_hash, store_path
+
+## CONFIGURATION ##
+CACHE_PATH = store_path("emotion_cache_v2.db")
+LEGACY_CACHE_PATH = "emotion_cache_v2.json"
+MAX_ENTRIES = int(os.getenv("EMOTION_CACHE_MAX_ENTRIES", "0")) or None
+
+SCHEMA = """
+-- Results are addressed by the SHA-256 of the image bytes, so the same
+-- pixels hit the cache whatever the file is called or wherever it lives
+CREATE TABLE IF NOT EXISTS emotions (
+    content_hash TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    last_access REAL NOT NULL,
+    -- Detector cascade outcome: "screened_out", "no_face" or the detector
+    -- backend that found the faces
+    detection TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_emotions_last_access ON emotions(last_access);
+
+-- Remembers each file's hash while its mtime/size are unchanged, so a file
+-- is only read in full when it is new or was modified
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+);
+"""
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+def detection_outcome(result):
+    if not result:
+        return "no_face"
+    return result[0].get("detector_backend")
+
+class EmotionCache:
+    """
+    Content-addressed emotion results. Lookups and writes touch only the rows
+    involved, WAL mode lets readers run while a writer commits, and an
+    optional max_entries cap evicts the least recently used results.
+    """
+
+    def __init__(self, db_path=CACHE_PATH, max_entries=MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    @property
+    def conn(self):
+        # SQLite connections can't be shared between threads; give each its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    ## HASHES ##
+    def content_hashes(self, paths):
+        """
+        {path: content hash}, reusing stored hashes for unchanged files.
+        Missing or unreadable files are left out.
+        """
+        hashes, updates = {}, []
+        for path in paths:
+            key = os.path.abspath(path)
+            try:
+                mtime, size = file_stamp(path)
+            except OSError:
+                continue
+            row = self.conn.execute(
+                "SELECT mtime, size, content_hash FROM file_hashes WHERE path = ?", (key,)
+            ).fetchone()
+            if row and (row[0], row[1]) == (mtime, size):
+                hashes[path] = row[2]
+                continue
+            try:
+                hashes[path] = file_content_hash(path)
+            except OSError:
+                continue
+            updates.append((key, mtime, size, hashes[path]))
+
+        if updates:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO file_hashes (path, mtime, size, content_hash) VALUES (?, ?, ?, ?)",
+                    updates,
+                )
+        return hashes
+
+    def forget_paths(self, paths):
+        """
+        Drop path -> hash rows for files that were deleted; results stay
+        cached under their hash for the next copy of the same image.
+        """
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM file_hashes WHERE path = ?", [(os.path.abspath(p),) for p in paths]
+            )
+
+    ## RESULTS ##
+    def get_many(self, paths, hashes=None):
+        """
+        {path: result} for every path whose contents have a cached result.
+        hashes optionally gives {path: content hash} the caller already resolved.
+        """
+        if hashes is None:
+            hashes = self.content_hashes(paths)
+        found = {}
+        for path in paths:
+            content_hash = hashes.get(path)
+            if content_hash is None:
+                continue
+            row = self.conn.execute(
+                "SELECT result FROM emotions WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if row:
+                found[path] = json.loads(row[0])
+
+        if found:
+            now = time.time()
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE emotions SET last_access = ? WHERE content_hash = ?",
+                    [(now, hashes[path]) for path in found],
+                )
+        return found
+
+    def get(self, path):
+        return self.get_many([path]).get(path)
+
+    def put_many(self, results, detections=None):
+        """
+        Store {path: result}; detections optionally gives {path: cascade outcome}.
+        """
+        detections = detections or {}
+        hashes = self.content_hashes(results)
+        now = time.time()
+        rows = [(hashes[path], json.dumps(result), now, detections.get(path) or detection_outcome(result))
+                for path, result in results.items() if path in hashes]
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO emotions (content_hash, result, last_access, detection) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(content_hash) DO UPDATE SET "
+                "result = excluded.result, last_access = excluded.last_access, detection = excluded.detection",
+                rows,
+            )
+            self._evict()
+
+    def put(self, path, result):
+        self.put_many({path: result})
+
+    def _evict(self):
+        if not self.max_entries:
+            return
+        count = self.conn.execute("SELECT COUNT(*) FROM emotions").fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM emotions WHERE content_hash IN "
+                "(SELECT content_hash FROM emotions ORDER BY last_access LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM emotions").fetchone()[0]
+
+    def live_hashes(self):
+        """
+        Hashes that still have a cached result and a known file: what the
+        score matrix and face index need to keep when they are compacted.
+        """
+        return {row[0] for row in self.conn.execute(
+            "SELECT DISTINCT f.content_hash FROM file_hashes f JOIN emotions e ON e.content_hash = f.content_hash"
+        )}
+
+    def detection_counts(self):
+        """
+        {cascade outcome: number of images}, for judging how much detector
+        work the screen saves.
+        """
+        return dict(self.conn.execute(
+            "SELECT COALESCE(detection, 'unknown'), COUNT(*) FROM emotions GROUP BY detection"
+        ))
+
+    def import_json(self, json_path=LEGACY_CACHE_PATH):
+        """
+        One-off migration from the old whole-file JSON cache.
+        """
+        with open(json_path, "r") as f:
+            legacy = json.load(f)
+        self.put_many({path: result for path, result in legacy.items() if os.path.exists(path)})
+        os.rename(json_path, json_path + ".migrated")
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmotionCache()
+            if os.path.exists(LEGACY_CACHE_PATH):
+                _cache.import_json()
+    return _cache
@@ -1,5 +1,8 @@
 import json
-from util import complex_emotion_map
+import os
+import sys
+import time
+from util import complex_emotion_map, emotion_labels
 
 def evaluate_session(log_file="session_results.jsonl"):
     stt_total = 0
@@ -26,12 +29,8 @@ def evaluate_session(log_file="session_results.jsonl"):
                 pred_emotion = entry["predicted"]
                 expected_key = entry["expected"]
 
-                if pred_emotion == expected_key:
+                if emotion_matches(pred_emotion, expected_key):
                     img_correct += 1
-                else:
-                    allowed = complex_emotion_map.get(expected_key, [expected_key])
-                    if pred_emotion in allowed:
-                        img_correct += 1
 
     print("\n📊 Evaluation Results:")
     if stt_total:
@@ -44,7 +43,47 @@ def evaluate_session(log_file="session_results.jsonl"):
     else:
         print("🖼️ No image sentiment records found.")
 
+def emotion_matches(predicted, expected):
+    return predicted == expected or predicted in complex_emotion_map.get(expected, [expected])
+
+def evaluate_max_side(folder="static/images_v2", sizes=(256, 384, 512, 768, 1024, 0)):
+    """
+    Accuracy and speed of emotion inference at different decode sizes. The
+    expected emotion is the filename prefix (happy_3.jpg -> happy); files
+    without a known prefix are skipped. A size of 0 means full resolution.
+    """
+    from sentiment_search_v2 import analyze_emotions_batch
+
+    labeled = []
+    for fname in sorted(os.listdir(folder)):
+        expected = fname.split("_")[0].lower()
+        if "_" in fname and (expected in emotion_labels or expected in complex_emotion_map):
+            labeled.append((os.path.join(folder, fname), expected))
+    paths = [path for path, _ in labeled]
+
+    # Warm up so model loading is not billed to the first size
+    analyze_emotions_batch(paths[:1])
+
+    print(f"\n📏 Max side vs accuracy on {len(labeled)} labeled images in {folder}:")
+    for max_side in sizes:
+        start = time.time()
+        results = analyze_emotions_batch(paths, max_side=max_side)
+        elapsed = time.time() - start
+
+        correct = sum(
+            1 for path, expected in labeled
+            if results.get(path) and emotion_matches(results[path][0]["dominant_emotion"], expected)
+        )
+        label = max_side or "full"
+        print(f"• {label:>5}: {correct}/{len(labeled)} = {(correct / len(labeled)) * 100:.2f}% "
+              f"| {elapsed / len(labeled) * 1000:.0f} ms/image")
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "max_side":
+        # Decode size vs accuracy report for the labeled V2 images
+        evaluate_max_side(*sys.argv[2:3])
+        sys.exit(0)
+
     # # V1 Evaluation
     # evaluate_session("session_results.jsonl")
 
@@ -0,0 +1,148 @@
+import atexit
+import json
+import os
+import threading
+from util import file_lock
+
+## CONFIGURATION ##
+EVAL_LOG_PATH = "user_evaluation.jsonl"
+# Buffered entries are written after this many seconds or this many entries, whichever comes first
+EVAL_FLUSH_INTERVAL = float(os.getenv("EVAL_FLUSH_INTERVAL", "2"))
+EVAL_FLUSH_SIZE = int(os.getenv("EVAL_FLUSH_SIZE", "50"))
+
+def empty_totals():
+    return {"correct": 0, "total": 0, "by_emotion": {}}
+
+def count_entry(totals, entry):
+    emotion = totals["by_emotion"].setdefault(entry.get("expected_emotion") or "unknown", {"correct": 0, "total": 0})
+    met = 1 if entry.get("met_expectation") else 0
+    totals["total"] += 1
+    totals["correct"] += met
+    emotion["total"] += 1
+    emotion["correct"] += met
+
+def merge_totals(a, b):
+    merged = {"correct": a["correct"] + b["correct"], "total": a["total"] + b["total"], "by_emotion": {}}
+    for emotion in a["by_emotion"].keys() | b["by_emotion"].keys():
+        x = a["by_emotion"].get(emotion, {"correct": 0, "total": 0})
+        y = b["by_emotion"].get(emotion, {"correct": 0, "total": 0})
+        merged["by_emotion"][emotion] = {"correct": x["correct"] + y["correct"], "total": x["total"] + y["total"]}
+    return merged
+
+class EvaluationLog:
+    """
+    User feedback on search results, appended to a JSONL file and counted
+    as it arrives. record() only buffers the entry and bumps its counters;
+    a background thread writes the buffer every flush_interval seconds (or
+    once flush_size entries wait) under the file lock, with an fsync, so a
+    crash loses at most one interval of feedback and never leaves a torn line
+    behind for the next writer.
+
+    summary() reads only the bytes appended since its last call, so entries
+    written by other workers are counted too, and the file is never parsed
+    from the start again unless it was truncated or replaced.
+    """
+
+    def __init__(self, path=EVAL_LOG_PATH, flush_interval=EVAL_FLUSH_INTERVAL, flush_size=EVAL_FLUSH_SIZE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._pending = []
+        self._pending_totals = empty_totals()
+        self._file_totals = empty_totals()
+        self._file_id = None
+        self._offset = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        threading.Thread(target=self._flush_loop, name="evaluation-log", daemon=True).start()
+        atexit.register(self.flush)
+
+    ## WRITES ##
+    def record(self, entry):
+        with self._lock:
+            self._pending.append(json.dumps(entry) + "\n")
+            count_entry(self._pending_totals, entry)
+            full = len(self._pending) >= self.flush_size
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            with file_lock(self.path), open(self.path, "ab+") as f:
+                # A crash mid-write can leave a partial last line; start ours on a fresh one
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                f.write("".join(self._pending).encode())
+                f.flush()
+                os.fsync(f.fileno())
+            # The written entries are counted again when summary() reads them back
+            self._pending = []
+            self._pending_totals = empty_totals()
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"⚠️ Could not write {self.path}: {e}")
+
+    def reset(self):
+        """
+        Drop every entry, buffered and written.
+        """
+        with self._lock, file_lock(self.path):
+            open(self.path, "w").close()
+            self._pending = []
+            self._pending_totals = empty_totals()
+            self._file_totals = empty_totals()
+            self._file_id = None
+            self._offset = 0
+
+    ## SUMMARY ##
+    def _catch_up(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._file_totals, self._file_id, self._offset = empty_totals(), None, 0
+            return
+        file_id = (stat.st_dev, stat.st_ino)
+        if file_id != self._file_id or stat.st_size < self._offset:
+            self._file_totals, self._file_id, self._offset = empty_totals(), file_id, 0
+        if stat.st_size == self._offset:
+            return
+
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(stat.st_size - self._offset)
+        # A line still being written is left for the next call
+        complete = data[:data.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            try:
+                count_entry(self._file_totals, json.loads(line))
+            except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+                continue
+        self._offset += len(complete)
+
+    def summary(self):
+        """
+        {"correct", "total", "percent", "by_emotion": {emotion: {"correct", "total", "percent"}}}
+        """
+        with self._lock:
+            self._catch_up()
+            totals = merge_totals(self._file_totals, self._pending_totals)
+        percent = lambda t: int((t["correct"] / t["total"]) * 100) if t["total"] > 0 else 0
+        return {
+            "percent": percent(totals),
+            "correct": totals["correct"],
+            "total": totals["total"],
+            "by_emotion": {
+                emotion: {**counts, "percent": percent(counts)}
+                for emotion, counts in sorted(totals["by_emotion"].items())
+            },
+        }
@@ -0,0 +1,122 @@
+import threading
+import numpy as np
+from score_matrix import MappedMatrix, NUM_EMOTIONS, emotion_vector, emotion_labels
+from util import store_path
+
+## CONFIGURATION ##
+FACE_MATRIX_PATH = store_path("face_index.f32")
+FACE_KEYS_PATH = store_path("face_index.keys")
+FACE_EMBEDDING_DIM = 128  # Facenet
+# DeepFace's Facenet cosine-distance threshold is 0.40, i.e. similarity >= 0.60
+SAME_PERSON_SIMILARITY = 0.60
+# Marks an image that was analyzed but has no real face, so it is not re-analyzed
+NO_FACE = "none"
+
+def has_embeddings(result):
+    # [] is a stored "no face" outcome, which needs no embeddings
+    return result is not None and all("embedding" in face for face in result)
+
+class FaceIndex(MappedMatrix):
+    """
+    One row per detected face: its unit-length embedding followed by that
+    face's 7 emotion scores. Keys are "<content hash>:<face number>".
+    """
+
+    def __init__(self, matrix_path=FACE_MATRIX_PATH, keys_path=FACE_KEYS_PATH):
+        super().__init__(matrix_path, keys_path, FACE_EMBEDDING_DIM + NUM_EMOTIONS)
+
+    def _reset(self):
+        super()._reset()
+        self.image_keys = []
+        self.image_ids = {}
+        self.face_image_ids = np.zeros(0, dtype=np.int64)
+
+    def _content_hash(self, key):
+        return key.rsplit(":", 1)[0]
+
+    def _on_new_keys(self, keys):
+        ids = []
+        for key in keys:
+            content_hash = self._content_hash(key)
+            if content_hash not in self.image_ids:
+                self.image_ids[content_hash] = len(self.image_keys)
+                self.image_keys.append(content_hash)
+            ids.append(self.image_ids[content_hash])
+        self.face_image_ids = np.concatenate([self.face_image_ids, np.array(ids, dtype=np.int64)])
+
+    def has_image(self, content_hash):
+        return content_hash in self.image_ids
+
+    def append_results(self, hashes, results):
+        """
+        Add every face of {path: DeepFace-style result with embeddings}.
+        Whole-frame fallbacks (confidence 0) are not faces and are skipped.
+        """
+        rows = {}
+        for path, result in results.items():
+            if path not in hashes or not has_embeddings(result):
+                continue
+            faces = 0
+            for i, face in enumerate(result):
+                if not face.get("face_confidence"):
+                    continue
+                embedding = np.asarray(face["embedding"], dtype=np.float32)
+                embedding /= max(float(np.linalg.norm(embedding)), 1e-12)
+                rows[f"{hashes[path]}:{i}"] = np.concatenate([embedding, emotion_vector(face["emotion"])])
+                faces += 1
+            if not faces:
+                rows[f"{hashes[path]}:{NO_FACE}"] = np.zeros(self.width, dtype=np.float32)
+        self.append(rows)
+
+    def search(self, template_embedding, content_hashes, weights, top_n=None,
+               threshold=SAME_PERSON_SIMILARITY):
+        """
+        Find faces of the template's person among the given images with one
+        cosine-similarity product over the stored embeddings, then rank the
+        matching faces by their own emotion scores. Returns
+        [(position in content_hashes, score, dominant emotion, similarity)],
+        one entry per image (its best face), highest score first.
+        """
+        template = np.asarray(template_embedding, dtype=np.float32)
+        template /= max(float(np.linalg.norm(template)), 1e-12)
+
+        # Ids and rows are taken together, since a compaction renumbers both
+        with self._lock:
+            positions = {}
+            for i, content_hash in enumerate(content_hashes):
+                if content_hash in self.image_ids:
+                    positions.setdefault(self.image_ids[content_hash], i)
+            values = self.values
+            face_image_ids = self.face_image_ids[:len(values)]
+        if not positions:
+            return []
+        rows = np.nonzero(np.isin(face_image_ids, np.fromiter(positions, dtype=np.int64)))[0]
+        similarity = values[rows, :FACE_EMBEDDING_DIM] @ template
+        matched = similarity >= threshold
+        rows, similarity = rows[matched], similarity[matched]
+
+        emotions = values[rows, FACE_EMBEDDING_DIM:]
+        scores = emotions @ weights
+        ranked, seen = [], set()
+        for i in np.argsort(-scores, kind="stable"):
+            image_id = int(face_image_ids[rows[i]])
+            if image_id in seen or scores[i] <= 0:
+                continue
+            seen.add(image_id)
+            ranked.append((positions[image_id], float(scores[i]),
+                           emotion_labels[int(np.argmax(emotions[i]))], float(similarity[i])))
+            if top_n and len(ranked) >= top_n:
+                break
+        return ranked
+
+_face_index = None
+_face_index_lock = threading.Lock()
+
+def get_face_index():
+    global _face_index
+    with _face_index_lock:
+        if _face_index is None:
+            _face_index = FaceIndex()
+            return _face_index
+    _face_index.refresh()
+    return _face_index
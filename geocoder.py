@@ -0,0 +1,213 @@
+import csv
+import math
+import os
+import threading
+from functools import lru_cache
+
+## CONFIGURATION ##
+# GeoNames dumps: https://download.geonames.org/export/dump/
+# cities*.txt for places, admin1CodesASCII.txt and countryInfo.txt for region names.
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", "data/gazetteer/cities500.txt")
+ADMIN1_PATH = os.getenv("GAZETTEER_ADMIN1_PATH", "data/gazetteer/admin1CodesASCII.txt")
+COUNTRY_PATH = os.getenv("GAZETTEER_COUNTRY_PATH", "data/gazetteer/countryInfo.txt")
+MAX_DISTANCE_KM = float(os.getenv("GAZETTEER_MAX_DISTANCE_KM", "50"))
+EARTH_RADIUS_KM = 6371.0
+
+# Column positions in the GeoNames "geoname" table
+COL_NAME, COL_ASCII_NAME, COL_LAT, COL_LON = 1, 2, 4, 5
+COL_FEATURE_CLASS, COL_COUNTRY, COL_ADMIN1, COL_POPULATION = 6, 8, 10, 14
+
+def to_unit_vector(lat, lon):
+    """
+    Project a coordinate onto the unit sphere so plain euclidean distance
+    orders places correctly, including across the antimeridian.
+    """
+    lat, lon = math.radians(lat), math.radians(lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+def chord_to_km(squared_chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(squared_chord) / 2))
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def wrap_longitude(lon):
+    return (lon + 180) % 360 - 180
+
+def bbox_around(lat, lon, radius_km):
+    """
+    (south, north, west, east) box enclosing a circle; west > east means the
+    box crosses the antimeridian.
+    """
+    dlat = radius_km / 111.32
+    south, north = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    cos_lat = math.cos(math.radians(lat))
+    if cos_lat < 1e-6 or radius_km / (111.32 * cos_lat) >= 180:
+        return south, north, -180.0, 180.0
+    dlon = radius_km / (111.32 * cos_lat)
+    return south, north, wrap_longitude(lon - dlon), wrap_longitude(lon + dlon)
+
+def place_radius_km(population):
+    """
+    Rough extent of a populated place, used when a query names a city
+    rather than a region.
+    """
+    return min(MAX_DISTANCE_KM, 5 + 0.5 * math.sqrt(population / 1000))
+
+def make_area(bbox, center=None, radius_km=None):
+    south, north, west, east = bbox
+    if center is None:
+        center = ((south + north) / 2, (west + east) / 2)
+    return {"bbox": bbox, "center": center, "radius_km": radius_km}
+
+## SPATIAL INDEX ##
+class KDTree:
+    def __init__(self, points):
+        # Each node is (point, index, axis, left, right)
+        self.root = self._build(list(enumerate(points)), 0)
+
+    def _build(self, items, depth):
+        if not items:
+            return None
+        axis = depth % 3
+        items.sort(key=lambda item: item[1][axis])
+        mid = len(items) // 2
+        index, point = items[mid]
+        return (point, index, axis,
+                self._build(items[:mid], depth + 1),
+                self._build(items[mid + 1:], depth + 1))
+
+    def nearest(self, target):
+        """
+        Return (index, squared distance) of the closest point to target.
+        """
+        tx, ty, tz = target
+        best_index, best_dist = None, float("inf")
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            point, index, axis, left, right = node
+            dist = (point[0] - tx) ** 2 + (point[1] - ty) ** 2 + (point[2] - tz) ** 2
+            if dist < best_dist:
+                best_index, best_dist = index, dist
+
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            if diff * diff < best_dist:
+                stack.append(far)
+            stack.append(near)
+        return best_index, best_dist
+
+## GAZETTEER ##
+def _read_rows(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            if row and not row[0].startswith("#"):
+                yield row
+
+def load_region_names(admin1_path=ADMIN1_PATH, country_path=COUNTRY_PATH):
+    admin1, countries = {}, {}
+    if os.path.exists(admin1_path):
+        admin1 = {row[0]: row[1] for row in _read_rows(admin1_path)}
+    if os.path.exists(country_path):
+        countries = {row[0]: row[4] for row in _read_rows(country_path)}
+    return admin1, countries
+
+class OfflineGeocoder:
+    def __init__(self, gazetteer_path=GAZETTEER_PATH, admin1_path=ADMIN1_PATH,
+                 country_path=COUNTRY_PATH, max_distance_km=MAX_DISTANCE_KM):
+        admin1, countries = load_region_names(admin1_path, country_path)
+        self.max_distance_km = max_distance_km
+        self.places = []
+        self.places_by_name = {}  # name -> index of the most populous place
+        self.regions = {}         # admin1/country name -> [south, north, west, east]
+        points = []
+        for row in _read_rows(gazetteer_path):
+            lat, lon = float(row[COL_LAT]), float(row[COL_LON])
+            region = admin1.get(f"{row[COL_COUNTRY]}.{row[COL_ADMIN1]}")
+            country = countries.get(row[COL_COUNTRY], row[COL_COUNTRY])
+            parts = [row[COL_NAME], region, country]
+            index = len(self.places)
+            self.places.append({
+                "name": row[COL_NAME].lower(),
+                "lat": lat,
+                "lon": lon,
+                "feature_class": row[COL_FEATURE_CLASS],
+                "population": int(row[COL_POPULATION] or 0),
+                "address": ", ".join(p for p in parts if p).lower(),
+            })
+            points.append(to_unit_vector(lat, lon))
+
+            for name in {row[COL_NAME].lower(), row[COL_ASCII_NAME].lower()}:
+                best = self.places_by_name.get(name)
+                if best is None or self.places[best]["population"] < self.places[index]["population"]:
+                    self.places_by_name[name] = index
+            for name in {region, country}:
+                if name:
+                    self._extend_region(name.lower(), lat, lon)
+
+        self.tree = KDTree(points)
+        self.reverse = lru_cache(maxsize=100_000)(self._reverse)
+        self.forward = lru_cache(maxsize=1024)(self._forward)
+
+    def _extend_region(self, name, lat, lon):
+        box = self.regions.setdefault(name, [lat, lat, lon, lon])
+        box[0], box[1] = min(box[0], lat), max(box[1], lat)
+        box[2], box[3] = min(box[2], lon), max(box[3], lon)
+
+    def _reverse(self, lat, lon):
+        index, dist = self.tree.nearest(to_unit_vector(lat, lon))
+        if index is None or chord_to_km(dist) > self.max_distance_km:
+            return None
+        return self.places[index]["address"]
+
+    def _forward(self, name, radius_km=None):
+        """
+        Resolve a place name to a search area. Cities become a box sized by
+        population, regions and countries the box around all of their places;
+        with radius_km the area is a circle around the place instead.
+        """
+        name = name.lower().strip()
+        if name in self.places_by_name:
+            place = self.places[self.places_by_name[name]]
+            center = (place["lat"], place["lon"])
+            extent = radius_km or place_radius_km(place["population"])
+            return make_area(bbox_around(*center, extent), center, radius_km)
+        if name in self.regions:
+            south, north, west, east = self.regions[name]
+            if radius_km:
+                center = ((south + north) / 2, (west + east) / 2)
+                return make_area(bbox_around(*center, radius_km), center, radius_km)
+            return make_area((south, north, west, east))
+        return None
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+def get_geocoder():
+    """
+    Lazily load the gazetteer once per process; None if no gazetteer is installed.
+    """
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None and os.path.exists(GAZETTEER_PATH):
+            _geocoder = OfflineGeocoder()
+    return _geocoder
+
+def reverse_geocode_offline(lat, lon):
+    geocoder = get_geocoder()
+    if geocoder is None:
+        return None
+    # Rounding to ~10 m keeps the per-coordinate cache effective for burst shots
+    return geocoder.reverse(round(lat, 4), round(lon, 4))
+
+def forward_geocode_offline(name, radius_km=None):
+    geocoder = get_geocoder()
+    if geocoder is None:
+        return None
+    return geocoder.forward(name, radius_km)
@@ -0,0 +1,245 @@
+import os
+import sqlite3
+from bisect import bisect_left
+from collections import namedtuple
+from contextlib import closing
+from datetime import datetime
+from emotion_cache import get_cache
+from image_metadata import read_metadata_batch
+from geocoder import haversine_km
+
+## CONFIGURATION ##
+INDEX_PATH = "image_index.db"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Bump whenever the schema changes; the index is derived data, so an
+# outdated file is simply dropped and rebuilt from the images on disk.
+SCHEMA_VERSION = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    -- SHA-256 of the file, so queries find stored results without a stat per file
+    content_hash TEXT,
+    taken_at TEXT,
+    lat REAL,
+    lon REAL,
+    location TEXT,
+    orientation INTEGER,
+    width INTEGER,
+    height INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_images_folder_taken_at ON images(folder, taken_at);
+
+-- Bumped on every change to a folder so in-memory columns know when to reload
+CREATE TABLE IF NOT EXISTS folders (
+    folder TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+
+-- Spatial index over GPS-tagged images, kept in step with images by triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS image_locations USING rtree(
+    id, min_lat, max_lat, min_lon, max_lon
+);
+CREATE TRIGGER IF NOT EXISTS images_location_insert AFTER INSERT ON images
+WHEN new.lat IS NOT NULL BEGIN
+    INSERT INTO image_locations VALUES (new.rowid, new.lat, new.lat, new.lon, new.lon);
+END;
+CREATE TRIGGER IF NOT EXISTS images_location_delete AFTER DELETE ON images BEGIN
+    DELETE FROM image_locations WHERE id = old.rowid;
+END;
+"""
+
+def connect(db_path=INDEX_PATH):
+    # WAL lets queries read while another thread or worker syncs a folder
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version != SCHEMA_VERSION:
+        conn.execute("DROP TABLE IF EXISTS images")
+        conn.execute("DROP TABLE IF EXISTS image_locations")
+        conn.execute("DROP TABLE IF EXISTS folders")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.executescript(SCHEMA)
+    return conn
+
+## SYNCING ##
+def scan_folder(folder):
+    """
+    Stat every image in a folder without opening it: {path: (mtime, size)}
+    """
+    found = {}
+    for entry in os.scandir(folder):
+        if not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        stat = entry.stat()
+        found[os.path.join(folder, entry.name)] = (stat.st_mtime, stat.st_size)
+    return found
+
+def sync_folder(folder, describe_location=None, db_path=INDEX_PATH):
+    """
+    Bring the index for a folder up to date. Only new or changed files are
+    read (and hashed, through the emotion cache's hash table);
+    describe_location(lat, lon) -> address fills in the location text for
+    GPS-tagged images. Removed files are dropped.
+    """
+    on_disk = scan_folder(folder)
+
+    with closing(connect(db_path)) as conn, conn:
+        indexed = {
+            path: (mtime, size)
+            for path, mtime, size in conn.execute(
+                "SELECT path, mtime, size FROM images WHERE folder = ?", (folder,)
+            )
+        }
+
+        stale = [path for path in indexed if path not in on_disk]
+        changed = [path for path, stamp in on_disk.items() if indexed.get(path) != stamp]
+
+        # Files are read before the write transaction starts, so the write
+        # lock is only held for the inserts themselves
+        rows = []
+        hashes = get_cache().content_hashes(changed)
+        for path, meta in read_metadata_batch(changed).items():
+            lat, lon = meta.gps if meta.gps else (None, None)
+            location = describe_location(lat, lon) if meta.gps and describe_location else None
+            mtime, size = on_disk[path]
+            rows.append((path, folder, mtime, size, hashes.get(path),
+                         meta.taken_at.strftime(DATE_FORMAT) if meta.taken_at else None,
+                         lat, lon, location, meta.orientation, meta.width, meta.height))
+
+        # Plain DELETE (rather than INSERT OR REPLACE) so the spatial index triggers fire
+        conn.executemany("DELETE FROM images WHERE path = ?", [(p,) for p in stale + changed])
+        conn.executemany(
+            "INSERT INTO images "
+            "(path, folder, mtime, size, content_hash, taken_at, lat, lon, location, orientation, width, height) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+        if stale or changed:
+            conn.execute(
+                "INSERT INTO folders (folder, generation) VALUES (?, 1) "
+                "ON CONFLICT(folder) DO UPDATE SET generation = generation + 1",
+                (folder,),
+            )
+
+    return len(changed), len(stale)
+
+## QUERIES ##
+# Sorted capture times per folder, reloaded only when the folder's generation changes
+DateColumn = namedtuple("DateColumn", ["generation", "timestamps", "paths", "undated"])
+_date_columns = {}
+
+def load_date_column(conn, folder, db_path=INDEX_PATH):
+    row = conn.execute("SELECT generation FROM folders WHERE folder = ?", (folder,)).fetchone()
+    generation = row[0] if row else 0
+    key = (os.path.abspath(db_path), folder)
+    column = _date_columns.get(key)
+    if column and column.generation == generation:
+        return column
+
+    timestamps, paths, undated = [], [], []
+    for path, taken_at in conn.execute(
+        "SELECT path, taken_at FROM images WHERE folder = ? ORDER BY taken_at", (folder,)
+    ):
+        if taken_at is None:
+            undated.append(path)
+        else:
+            timestamps.append(datetime.strptime(taken_at, DATE_FORMAT))
+            paths.append(path)
+
+    column = DateColumn(generation, timestamps, paths, undated)
+    _date_columns[key] = column
+    return column
+
+def query_by_date(folder, date_range=None, db_path=INDEX_PATH):
+    """
+    Images captured inside date_range, found by bisecting the sorted capture
+    times: O(log N) per interval plus the number of matches. Undated images
+    are a separate bucket, only returned when there is no date_range.
+    """
+    with closing(connect(db_path)) as conn:
+        column = load_date_column(conn, folder, db_path)
+
+    if date_range is None:
+        return column.paths + column.undated
+
+    matches = []
+    if column.timestamps:
+        first_year, last_year = column.timestamps[0].year, column.timestamps[-1].year
+        for start, end in date_range.intervals(first_year, last_year):
+            lo = bisect_left(column.timestamps, start) if start else 0
+            hi = bisect_left(column.timestamps, end) if end else len(column.timestamps)
+            matches += column.paths[lo:hi]
+    return matches
+
+# {path: content hash} for the whole index, reloaded only when a folder's generation changes
+_hash_maps = {}
+
+def content_hashes(paths, db_path=INDEX_PATH):
+    """
+    {path: content hash} from what the last sync stored, read with one query
+    per index change rather than a stat per file. Paths that aren't indexed
+    fall back to the emotion cache, which stats and (if needed) hashes them.
+    """
+    with closing(connect(db_path)) as conn:
+        generations = conn.execute("SELECT folder, generation FROM folders ORDER BY folder").fetchall()
+        key = os.path.abspath(db_path)
+        hash_map = _hash_maps.get(key)
+        if hash_map is None or hash_map[0] != generations:
+            hash_map = (generations, dict(conn.execute(
+                "SELECT path, content_hash FROM images WHERE content_hash IS NOT NULL"
+            )))
+            _hash_maps[key] = hash_map
+
+    stored = hash_map[1]
+    hashes = {path: stored[path] for path in paths if path in stored}
+    unindexed = [path for path in paths if path not in stored]
+    if unindexed:
+        hashes.update(get_cache().content_hashes(unindexed))
+    return hashes
+
+def query_by_location(folder, target_location=None, db_path=INDEX_PATH):
+    sql = "SELECT path FROM images WHERE folder = ?"
+    params = [folder]
+    if target_location:
+        sql += " AND (location IS NULL OR instr(location, ?) > 0)"
+        params.append(target_location)
+
+    with closing(connect(db_path)) as conn:
+        return [row[0] for row in conn.execute(sql, params)]
+
+def query_by_area(folder, area, db_path=INDEX_PATH):
+    """
+    Range query over the spatial index. Images without GPS are kept, matching
+    the behaviour of the address filter.
+    """
+    south, north, west, east = area["bbox"]
+    lon_ranges = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+
+    sql = (
+        "SELECT i.path, i.lat, i.lon FROM image_locations r JOIN images i ON i.rowid = r.id "
+        "WHERE i.folder = ? AND r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?"
+    )
+    with closing(connect(db_path)) as conn:
+        candidates = []
+        for lon_min, lon_max in lon_ranges:
+            candidates += conn.execute(sql, (folder, south, north, lon_min, lon_max)).fetchall()
+        without_gps = [
+            row[0] for row in
+            conn.execute("SELECT path FROM images WHERE folder = ? AND lat IS NULL", (folder,))
+        ]
+
+    radius_km = area.get("radius_km")
+    if radius_km:
+        center_lat, center_lon = area["center"]
+        candidates = [
+            row for row in candidates
+            if haversine_km(center_lat, center_lon, row[1], row[2]) <= radius_km
+        ]
+    return [row[0] for row in candidates] + without_gps
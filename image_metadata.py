@@ -0,0 +1,81 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from PIL import Image
+
+## EXIF TAGS ##
+TAG_ORIENTATION = 0x0112
+TAG_DATETIME_ORIGINAL = 0x9003
+IFD_EXIF = 0x8769
+IFD_GPS = 0x8825
+GPS_LAT_REF, GPS_LAT, GPS_LON_REF, GPS_LON = 1, 2, 3, 4
+
+ImageMetadata = namedtuple("ImageMetadata", ["taken_at", "gps", "orientation", "width", "height"])
+EMPTY_METADATA = ImageMetadata(None, None, 1, None, None)
+
+def dms_to_decimal(dms, ref):
+    degrees, minutes, seconds = dms
+    decimal = degrees + minutes / 60 + seconds / 3600
+    if ref in ['S', 'W']:
+        decimal *= -1
+    return float(decimal)
+
+def _parse_gps(gps_ifd):
+    try:
+        lat = dms_to_decimal(gps_ifd[GPS_LAT], gps_ifd[GPS_LAT_REF])
+        lon = dms_to_decimal(gps_ifd[GPS_LON], gps_ifd[GPS_LON_REF])
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        return None
+    return lat, lon
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(str(value).strip("\x00 "), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+
+## EXTRACTION ##
+def read_image_metadata(image_path):
+    """
+    Read capture date, GPS, orientation and size in a single open of the file.
+    Image.open only parses the header; the raw EXIF block it collects there is
+    decoded directly, so pixel data is never touched.
+    """
+    with Image.open(image_path) as img:
+        width, height = img.size
+        raw_exif = img.info.get("exif")
+
+    if not raw_exif:
+        return ImageMetadata(None, None, 1, width, height)
+
+    exif = Image.Exif()
+    exif.load(raw_exif)
+    exif_ifd = exif.get_ifd(IFD_EXIF)
+    gps_ifd = exif.get_ifd(IFD_GPS)
+
+    taken_at = exif_ifd.get(TAG_DATETIME_ORIGINAL)
+    return ImageMetadata(
+        taken_at=_parse_date(taken_at) if taken_at else None,
+        gps=_parse_gps(gps_ifd) if gps_ifd else None,
+        orientation=exif.get(TAG_ORIENTATION, 1),
+        width=width,
+        height=height,
+    )
+
+def _read_or_empty(image_path):
+    try:
+        return read_image_metadata(image_path)
+    except Exception as e:
+        print(f"⚠️ Could not read metadata from {image_path}: {e}")
+        return EMPTY_METADATA
+
+def read_metadata_batch(image_paths, max_workers=8):
+    """
+    Extract metadata for many files at once. Reads are I/O bound (especially on
+    network mounts), so a thread pool overlaps the per-file latency.
+    """
+    image_paths = list(image_paths)
+    if not image_paths:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(image_paths))) as pool:
+        return dict(zip(image_paths, pool.map(_read_or_empty, image_paths)))
@@ -0,0 +1,136 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from emotion_cache import get_cache
+from score_matrix import get_score_matrix
+from face_index import get_face_index, has_embeddings
+from image_index import IMAGE_EXTENSIONS
+from emotion_backend import EMOTION_BACKEND, BACKENDS, get_backend, set_backend
+
+## CONFIGURATION ##
+# Images the model could not process; skipped on resume unless --retry-failed
+FAILED_LOG_PATH = "emotion_index_failed.jsonl"
+DEFAULT_CHUNK_SIZE = 16
+
+def list_images(folder, recursive=True):
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        paths += [os.path.join(root, f) for f in sorted(files) if f.lower().endswith(IMAGE_EXTENSIONS)]
+        if not recursive:
+            break
+    return paths
+
+## FAILURES ##
+def read_failed(failed_log_path=FAILED_LOG_PATH):
+    failed = set()
+    if not os.path.exists(failed_log_path):
+        return failed
+    with open(failed_log_path, "r") as f:
+        for line in f:
+            try:
+                failed.add(json.loads(line)["path"])
+            except (json.JSONDecodeError, KeyError):
+                continue
+    return failed
+
+## WORKERS ##
+def _init_worker(backend):
+    # One backend (and model instance) per process, loaded before the first chunk arrives
+    set_backend(backend).warm_up()
+
+def _analyze_chunk(paths):
+    detections = {}
+    return paths, get_backend().analyze(paths, detections=detections), detections
+
+## COMPACTION ##
+def compact_stores():
+    """
+    Drop score matrix and face index rows for images that were edited,
+    deleted or evicted from the emotion cache, so the stores stay as bounded
+    as the cache. Returns {store: rows dropped}.
+    """
+    live = get_cache().live_hashes()
+    dropped = {"emotion_scores": get_score_matrix().compact(live), "face_index": get_face_index().compact(live)}
+    if any(dropped.values()):
+        print(f"🧹 Compacted emotion stores: {dropped}")
+    return dropped
+
+## INDEXING ##
+def index_folder(folder, workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 failed_log_path=FAILED_LOG_PATH, retry_failed=False, backend=EMOTION_BACKEND):
+    """
+    Precompute emotion scores for every image under folder. Each finished
+    chunk is committed to the emotion cache straight away, so an interrupted
+    run resumes with whatever is not cached yet.
+    """
+    cache = get_cache()
+    matrix = get_score_matrix()
+    faces = get_face_index()
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    failed = set() if retry_failed else read_failed(failed_log_path)
+
+    images = list_images(folder)
+    # Results cached before face embeddings were stored are indexed again
+    cached = {path for path, result in cache.get_many(images).items() if has_embeddings(result)}
+    todo = [path for path in images if path not in cached and os.path.abspath(path) not in failed]
+    print(f"📂 {len(todo)} images to index in {folder} "
+          f"({len(cached)} already cached, {len(failed)} previously failed)")
+    if not todo:
+        compact_stores()
+        return
+
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+    processed = 0
+    start = time.time()
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(backend,)) as pool, \
+            open(failed_log_path, "a") as failed_log:
+        pending = set()
+        remaining = iter(chunks)
+        # Keep a bounded number of chunks in flight so progress is written steadily
+        for chunk in remaining:
+            pending.add(pool.submit(_analyze_chunk, chunk))
+            if len(pending) >= workers * 2:
+                break
+
+        while pending:
+            completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in completed:
+                paths, results, detections = future.result()
+                cache.put_many(results, detections)
+                hashes = cache.content_hashes(results)
+                matrix.append_results(hashes, results)
+                faces.append_results(hashes, results)
+                for path in paths:
+                    if path not in results:
+                        failed_log.write(json.dumps({"path": os.path.abspath(path)}) + "\n")
+                failed_log.flush()
+
+                processed += len(paths)
+                elapsed = time.time() - start
+                print(f"⚡ {processed}/{len(todo)} images | {processed / elapsed:.1f} images/sec")
+
+                next_chunk = next(remaining, None)
+                if next_chunk:
+                    pending.add(pool.submit(_analyze_chunk, next_chunk))
+
+    elapsed = time.time() - start
+    print(f"✅ Indexed {processed} images in {elapsed:.1f}s ({processed / elapsed:.1f} images/sec)")
+    print(f"🔎 Detection outcomes: {cache.detection_counts()}")
+    compact_stores()
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m sentiment_search_v2 index",
+                                     description="Precompute emotion scores for a photo folder")
+    parser.add_argument("folder")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPUs - 1)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="images per model batch")
+    parser.add_argument("--failed-log", default=FAILED_LOG_PATH)
+    parser.add_argument("--retry-failed", action="store_true", help="retry images that failed before")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=EMOTION_BACKEND, help="emotion inference backend")
+    args = parser.parse_args(argv)
+    index_folder(args.folder, args.workers, args.chunk_size, args.failed_log, args.retry_failed, args.backend)
@@ -0,0 +1,210 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from emotion_cache import get_cache
+from face_index import has_embeddings
+from image_index import scan_folder, sync_folder
+from indexer import compact_stores
+from thumbnails import get_thumbnail_store
+
+## CONFIGURATION ##
+# Library folders to watch, separated by os.pathsep (":" on macOS/Linux, ";" on Windows)
+LIBRARY_FOLDERS = [f for f in os.getenv("LIBRARY_FOLDERS", "static/images_v2").split(os.pathsep) if f]
+POLL_INTERVAL = float(os.getenv("INGESTION_POLL_INTERVAL", "2"))
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+INGESTION_BATCH_SIZE = 16
+# Images whose analysis failed are retried after poll_interval, doubling up to this many seconds
+INGESTION_RETRY_MAX = float(os.getenv("INGESTION_RETRY_MAX", "300"))
+# Seconds between compactions of the score matrix and face index (0 = never)
+COMPACT_INTERVAL = float(os.getenv("COMPACT_INTERVAL", "3600"))
+
+class IngestionService:
+    """
+    Watches library folders for created, modified and deleted images and
+    feeds them to a worker pool that refreshes the metadata index,
+    thumbnails and emotion scores, so queries only ever read stored results.
+
+    Changes are found by diffing stat snapshots every poll_interval seconds,
+    which works the same on local disks and network mounts. A file only
+    enters the snapshot once it is stored, so images whose analysis failed
+    or was skipped are picked up again by a later poll, with backoff.
+    analyze_and_store(paths) must run inference, persist the results and
+    return {path: result} for the images it stored; describe_location(lat,
+    lon) fills in place names for the metadata index.
+    """
+
+    def __init__(self, analyze_and_store, describe_location=None, folders=None,
+                 poll_interval=POLL_INTERVAL, workers=INGESTION_WORKERS, batch_size=INGESTION_BATCH_SIZE,
+                 retry_max=INGESTION_RETRY_MAX, compact_interval=COMPACT_INTERVAL):
+        self.analyze_and_store = analyze_and_store
+        self.describe_location = describe_location
+        self.folders = folders or LIBRARY_FOLDERS
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.retry_max = retry_max
+        self.compact_interval = compact_interval
+        self._last_compact = time.monotonic()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self.snapshots = {}
+        # folder -> {path: (failed attempts, monotonic time of the next try)}
+        self.failures = {}
+        self.in_flight = set()
+        self.pending = 0
+        self.ingested = 0
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ingestion-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.pool.shutdown(wait=True)
+
+    def run_once(self):
+        """
+        One synchronous pass over every folder: index, thumbnail and analyze
+        whatever is new, then return once the workers are done.
+        """
+        for folder in self.folders:
+            self._poll(folder)
+        self.pool.shutdown(wait=True)
+        compact_stores()
+        return self
+
+    def status(self):
+        with self._lock:
+            return {
+                "folders": self.folders,
+                "pending": self.pending,
+                "ingested": self.ingested,
+                "failed": sum(len(failures) for failures in self.failures.values()),
+                "initial_scan_done": self.ready.is_set(),
+            }
+
+    ## WATCHING ##
+    def _run(self):
+        while not self._stop.is_set():
+            for folder in self.folders:
+                try:
+                    self._poll(folder)
+                except Exception as e:
+                    print(f"⚠️ Ingestion could not scan {folder}: {e}")
+            if not self.ready.is_set() and self.pending == 0:
+                self.ready.set()
+            self._maybe_compact()
+            self._stop.wait(self.poll_interval)
+
+    def _maybe_compact(self):
+        # Only between batches, so no worker appends while the files are rewritten
+        if not self.compact_interval or self.pending or time.monotonic() - self._last_compact < self.compact_interval:
+            return
+        self._last_compact = time.monotonic()
+        try:
+            compact_stores()
+        except Exception as e:
+            print(f"⚠️ Could not compact the emotion stores: {e}")
+
+    def _poll(self, folder):
+        if not os.path.isdir(folder):
+            return
+        current = scan_folder(folder)
+        now = time.monotonic()
+        with self._lock:
+            previous = dict(self.snapshots.setdefault(folder, {}))
+            failures = dict(self.failures.setdefault(folder, {}))
+            waiting = self.in_flight | {path for path, (_, retry_at) in failures.items() if retry_at > now}
+        changed = [path for path, stamp in current.items() if previous.get(path) != stamp and path not in waiting]
+        deleted = [path for path in previous.keys() | failures.keys() if path not in current]
+        if not changed and not deleted:
+            return
+
+        # Metadata first, in one transaction, so date/location filters see
+        # the change as soon as the emotion scores are ready
+        sync_folder(folder, self.describe_location)
+        if deleted:
+            get_cache().forget_paths(deleted)
+
+        # Thumbnails don't depend on analysis, so the gallery can show new photos right away
+        thumbnails = get_thumbnail_store()
+        for i in range(0, len(changed), self.batch_size):
+            self.pool.submit(self._thumbnail, thumbnails, changed[i:i + self.batch_size])
+
+        # On the first pass every file counts as changed; skip what is cached
+        cached = get_cache().get_many(changed)
+        todo = [path for path in changed if not has_embeddings(cached.get(path))]
+        with self._lock:
+            snapshot, failures = self.snapshots[folder], self.failures[folder]
+            for path in deleted:
+                snapshot.pop(path, None)
+                failures.pop(path, None)
+            for path in changed:
+                if has_embeddings(cached.get(path)):
+                    snapshot[path] = current[path]
+                    failures.pop(path, None)
+            self.in_flight.update(todo)
+        for i in range(0, len(todo), self.batch_size):
+            batch = {path: current[path] for path in todo[i:i + self.batch_size]}
+            with self._lock:
+                self.pending += len(batch)
+            self.pool.submit(self._ingest, folder, batch)
+
+    ## WORKERS ##
+    def _thumbnail(self, thumbnails, paths):
+        try:
+            thumbnails.ensure(paths)
+        except Exception as e:
+            print(f"⚠️ Thumbnails failed for {len(paths)} images: {e}")
+
+    def _ingest(self, folder, stamps):
+        """
+        Analyze {path: stat stamp}; stored images join the folder's snapshot,
+        the rest are scheduled for another try.
+        """
+        results = {}
+        try:
+            results = self.analyze_and_store(list(stamps)) or {}
+        except Exception as e:
+            print(f"❌ Ingestion failed for {len(stamps)} images: {e}")
+        stored = [path for path in stamps if path in results]
+        now = time.monotonic()
+        with self._lock:
+            snapshot, failures = self.snapshots.setdefault(folder, {}), self.failures.setdefault(folder, {})
+            for path, stamp in stamps.items():
+                self.in_flight.discard(path)
+                if path in results:
+                    snapshot[path] = stamp
+                    failures.pop(path, None)
+                else:
+                    attempts = failures.get(path, (0, 0))[0] + 1
+                    failures[path] = (attempts, now + min(self.poll_interval * 2 ** attempts, self.retry_max))
+            self.pending -= len(stamps)
+            self.ingested += len(stored)
+        if len(stored) < len(stamps):
+            print(f"⚠️ {len(stamps) - len(stored)} images were not analyzed and will be retried")
+
+if __name__ == "__main__":
+    # Standalone watcher for multi-worker deployments (INGESTION_MODE=external),
+    # so exactly one process ingests while every web worker only reads
+    import sys
+    from sentiment_search_v2 import analyze_and_store, reverse_geocode
+    if "--once" in sys.argv:
+        service = IngestionService(analyze_and_store, describe_location=reverse_geocode).run_once()
+        print(f"✅ Ingested {service.status()['ingested']} images")
+        sys.exit(0)
+    service = IngestionService(analyze_and_store, describe_location=reverse_geocode).start()
+    print(f"👀 Watching {', '.join(service.folders)} for new photos (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"📊 {service.status()}")
+    except KeyboardInterrupt:
+        service.stop()
@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+## CONFIGURATION ##
+DEFAULT_QUERIES = [
+    "show me the top 5 happy pictures",
+    "sad photos from last year",
+    "top 3 surprised pictures from summer 2023",
+    "not negative pictures near paris",
+    "show me goofy photos",
+]
+# {workers} and {port} are filled in for each run of --workers
+DEFAULT_SERVER_COMMAND = "gunicorn --workers {workers} --threads 4 --bind 127.0.0.1:{port} app:app"
+
+## REQUESTS ##
+def send_query(url, query):
+    body = json.dumps({"query": query, "uploaded": [], "useAI": False}).encode()
+    req = urllib.request.Request(url + "/process_query", data=body, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=300) as response:
+        response.read()
+        ok = response.status == 200
+    return ok, time.perf_counter() - start
+
+def has_results(url, queries=DEFAULT_QUERIES):
+    """
+    True if any query returns photos. Against an empty index every query
+    takes the cheap no-results path, which says nothing about real load.
+    """
+    for query in queries:
+        body = json.dumps({"query": query, "uploaded": [], "useAI": False}).encode()
+        req = urllib.request.Request(url + "/process_query", data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=300) as response:
+            if json.loads(response.read()).get("results"):
+                return True
+    return False
+
+def run_load(url, concurrency, total, queries=DEFAULT_QUERIES):
+    """
+    Send total queries with concurrency requests in flight; returns throughput
+    and latency statistics.
+    """
+    latencies, errors = [], 0
+
+    def one(i):
+        try:
+            return send_query(url, queries[i % len(queries)])
+        except Exception:
+            return False, None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for ok, latency in pool.map(one, range(total)):
+            if ok:
+                latencies.append(latency)
+            else:
+                errors += 1
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else float("nan")
+    return {
+        "requests": total,
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else float("nan"),
+        "p50_ms": pick(0.50) * 1000,
+        "p95_ms": pick(0.95) * 1000,
+    }
+
+## SERVERS ##
+def wait_until_up(url, timeout=300):
+    """
+    Wait for /ready, which answers 200 once the server's models are warm.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url + "/ready", timeout=5):
+                return True
+        except Exception:
+            time.sleep(1)
+    return False
+
+def report(label, stats):
+    print(f"• {label}: {stats['throughput']:.2f} req/s | mean {stats['mean_ms']:.0f} ms | "
+          f"p50 {stats['p50_ms']:.0f} ms | p95 {stats['p95_ms']:.0f} ms | {stats['errors']} errors")
+
+def report_scaling(runs):
+    """
+    Throughput per worker count relative to the smallest one.
+    """
+    if not runs:
+        return
+    base_workers, base = runs[0]
+    print(f"\n📈 Scaling (relative to {base_workers} worker(s)):")
+    print("| workers | req/s | speedup | p95 ms |")
+    print("|---|---|---|---|")
+    for workers, stats in runs:
+        speedup = stats["throughput"] / base["throughput"] if base["throughput"] else float("nan")
+        print(f"| {workers} | {stats['throughput']:.2f} | {speedup:.2f}x | {stats['p95_ms']:.0f} |")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /process_query")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="server to test when --workers is not given")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight")
+    parser.add_argument("--requests", type=int, default=100, help="requests per run")
+    parser.add_argument("--workers", type=int, nargs="*",
+                        help="start a server per worker count (e.g. 1 2 4) and compare throughput")
+    parser.add_argument("--server-command", default=DEFAULT_SERVER_COMMAND)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--skip-ingestion", action="store_true",
+                        help="don't run an ingestion pass before starting servers")
+    args = parser.parse_args()
+
+    if not args.workers:
+        if not wait_until_up(args.url, timeout=10):
+            print(f"❌ No server answering at {args.url}")
+            return
+        if not has_results(args.url):
+            print("❌ Queries return no photos; index the library first (python ingestion.py --once)")
+            return
+        report(args.url, run_load(args.url, args.concurrency, args.requests))
+        return
+
+    # Workers run with INGESTION_MODE=external and never scan the library
+    # themselves, so index and score it once up front
+    if not args.skip_ingestion:
+        print("📥 Indexing the library before the benchmark...")
+        subprocess.run([sys.executable, "ingestion.py", "--once"], check=True)
+
+    url = f"http://127.0.0.1:{args.port}"
+    print(f"🏋️ {args.requests} requests, {args.concurrency} in flight, per worker count:")
+    runs = []
+    for workers in args.workers:
+        command = args.server_command.format(workers=workers, port=args.port)
+        server = subprocess.Popen(shlex.split(command), env={**os.environ, "INGESTION_MODE": "external"})
+        try:
+            if not wait_until_up(url):
+                print(f"❌ Server did not start: {command}")
+                continue
+            if not has_results(url):
+                print("❌ Queries return no photos, so the benchmark would only measure the empty path")
+                return
+            # Untimed pass so every worker has served a request before the measurement
+            run_load(url, workers, workers * 4)
+            stats = run_load(url, args.concurrency, args.requests)
+            report(f"{workers} worker(s)", stats)
+            runs.append((workers, stats))
+        finally:
+            server.terminate()
+            server.wait()
+    report_scaling(runs)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+
+## CONFIGURATION ##
+SPACY_MODEL = os.getenv("SPACY_MODEL", "en_core_web_sm")
+
+class ModelRegistry:
+    """
+    Process-wide models, each loaded once on first use and then shared by
+    every thread. warm_up() loads everything and runs one inference per
+    model ahead of the first request; status() reports readiness and how
+    long each model took to load and warm up.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._metrics = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.ready = threading.Event()
+
+    def register(self, name, load, warm_up=None, required=True):
+        """
+        load() builds the model; warm_up(model) runs a throwaway inference.
+        Models that aren't required (e.g. API clients without a key) don't
+        hold up readiness when they fail to load.
+        """
+        self._loaders[name] = (load, warm_up, required)
+        self._locks[name] = threading.Lock()
+        self._metrics[name] = {"loaded": False, "required": required}
+
+    def get(self, name):
+        if name in self._models:
+            return self._models[name]
+        with self._locks[name]:
+            if name not in self._models:
+                start = time.perf_counter()
+                self._models[name] = self._loaders[name][0]()
+                self._record(name, loaded=True, load_seconds=round(time.perf_counter() - start, 3))
+        return self._models[name]
+
+    def _record(self, name, **metrics):
+        with self._lock:
+            self._metrics[name].update(metrics)
+
+    ## WARM-UP ##
+    def warm_up(self):
+        """
+        Load and exercise every registered model; failures are recorded per
+        model instead of raised.
+        """
+        start = time.perf_counter()
+        for name, (_, warm_up, _) in self._loaders.items():
+            try:
+                model = self.get(name)
+                if warm_up:
+                    warm_start = time.perf_counter()
+                    warm_up(model)
+                    self._record(name, warm_up_seconds=round(time.perf_counter() - warm_start, 3))
+                print(f"🔥 {name} ready")
+            except Exception as e:
+                self._record(name, error=str(e))
+                print(f"⚠️ Could not load {name}: {e}")
+        with self._lock:
+            self.warm_up_seconds = round(time.perf_counter() - start, 3)
+        self.ready.set()
+
+    def start_warm_up(self):
+        threading.Thread(target=self.warm_up, name="model-warm-up", daemon=True).start()
+
+    def status(self):
+        with self._lock:
+            models = {name: dict(metrics) for name, metrics in self._metrics.items()}
+            warm_up_seconds = getattr(self, "warm_up_seconds", None)
+        ready = self.ready.is_set() and all(m["loaded"] for m in models.values() if m["required"])
+        return {"ready": ready, "warm_up_seconds": warm_up_seconds, "models": models}
+
+## STANDARD MODELS ##
+def _load_spacy():
+    import spacy
+    return spacy.load(SPACY_MODEL)
+
+def _load_vader():
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    return SentimentIntensityAnalyzer()
+
+def _load_emotion_backend():
+    from emotion_backend import get_backend
+    return get_backend()
+
+def _load_genai_client():
+    from ai_evaluator import make_client
+    return make_client()
+
+registry = ModelRegistry()
+registry.register("spacy", _load_spacy, lambda nlp: nlp("happy photos from paris last summer"))
+registry.register("vader", _load_vader, lambda vader: vader.polarity_scores("not a sad picture"))
+registry.register("emotion_backend", _load_emotion_backend, lambda backend: backend.warm_up())
+# Creating the client makes no request, so there is nothing to warm up
+registry.register("genai_client", _load_genai_client, required=False)
+
+def get_model(name):
+    return registry.get(name)
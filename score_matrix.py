@@ -0,0 +1,235 @@
+import os
+import threading
+import uuid
+import numpy as np
+from util import complex_emotion_map, emotion_synonyms, emotion_labels, store_path, file_lock
+
+## CONFIGURATION ##
+MATRIX_PATH = store_path("emotion_scores.f32")
+KEYS_PATH = store_path("emotion_scores.keys")
+NUM_EMOTIONS = len(emotion_labels)
+ROW_ITEM_BYTES = np.dtype(np.float32).itemsize
+# compact() only rewrites the files once at least this share of rows is dead
+COMPACT_MIN_DEAD_FRACTION = float(os.getenv("COMPACT_MIN_DEAD_FRACTION", "0.1"))
+COMPACT_CHUNK_ROWS = 65536
+
+## WEIGHTS ##
+def build_weight_matrix():
+    """
+    Compile every emotion a query can ask for into one row of weights over
+    the DeepFace emotions: base emotions are one-hot, complex emotions sum
+    their components, and synonyms reuse the row of the emotion they map to.
+    """
+    names = list(emotion_labels) + list(complex_emotion_map)
+    rows = {name: i for i, name in enumerate(names)}
+    weights = np.zeros((len(names) + len(emotion_synonyms), NUM_EMOTIONS), dtype=np.float32)
+    for name, i in rows.items():
+        for component in complex_emotion_map.get(name, [name]):
+            weights[i, emotion_labels.index(component)] = 1.0
+    for j, (synonym, target) in enumerate(emotion_synonyms.items()):
+        weights[len(names) + j] = weights[rows[target]]
+        rows[synonym] = len(names) + j
+    return rows, weights
+
+WEIGHT_ROWS, WEIGHT_MATRIX = build_weight_matrix()
+
+def emotion_weights(emotion):
+    row = WEIGHT_ROWS.get(emotion)
+    if row is None:
+        return np.zeros(NUM_EMOTIONS, dtype=np.float32)
+    return WEIGHT_MATRIX[row]
+
+def emotion_vector(scores):
+    return [float(scores.get(label, 0)) for label in emotion_labels]
+
+## MAPPED MATRIX ##
+class MappedMatrix:
+    """
+    Append-only float32 matrix backed by a raw file that is memory-mapped
+    read-only, so several processes share the same pages instead of each
+    holding a copy. A parallel keys file names each row. compact() rewrites
+    both files without the rows of images that are gone, and every process
+    starts over from the new files on its next refresh.
+    """
+
+    def __init__(self, matrix_path, keys_path, width):
+        self.matrix_path = matrix_path
+        self.keys_path = keys_path
+        self.width = width
+        self._lock = threading.RLock()
+        self._reset()
+        self.refresh()
+
+    def _reset(self):
+        self.keys = []
+        self.rows = {}
+        self.values = np.zeros((0, self.width), dtype=np.float32)
+        self._keys_offset = 0
+        self._keys_id = None
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _on_new_keys(self, keys):
+        """
+        Hook for subclasses that keep extra per-row bookkeeping.
+        """
+
+    def _content_hash(self, key):
+        return key
+
+    def refresh(self):
+        """
+        Pick up rows appended since the last call (by this or another
+        process), or every row again after a compaction.
+        """
+        try:
+            stat = os.stat(self.keys_path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if (stat.st_dev, stat.st_ino) == self._keys_id and stat.st_size == self._keys_offset:
+                return
+            # Under the file lock so a compaction is never seen half done
+            with file_lock(self.matrix_path):
+                self._sync()
+
+    def _sync(self):
+        """
+        refresh() for callers already holding self._lock and the file lock.
+        """
+        stat = os.stat(self.keys_path)
+        if (stat.st_dev, stat.st_ino) != self._keys_id:
+            if self._keys_id is not None:
+                self._reset()
+            self._keys_id = (stat.st_dev, stat.st_ino)
+        new_keys = []
+        # Binary mode keeps offsets in bytes on every platform (text mode
+        # on Windows writes "\r\n" but would count one character)
+        with open(self.keys_path, "rb") as f:
+            f.seek(self._keys_offset)
+            for line in iter(f.readline, b""):
+                if not line.endswith(b"\n"):
+                    break  # partially written by a concurrent append
+                key = line.decode().strip()
+                self.rows[key] = len(self.keys)
+                self.keys.append(key)
+                new_keys.append(key)
+                self._keys_offset = f.tell()
+
+        if len(self.keys) != len(self.values):
+            self.values = np.memmap(self.matrix_path, dtype=np.float32, mode="r",
+                                    shape=(len(self.keys), self.width))
+        if new_keys:
+            self._on_new_keys(new_keys)
+
+    def append(self, rows_by_key):
+        """
+        Add {key: row vector} rows. Rows are written before their keys, so
+        readers never see a key without its values.
+        """
+        # The file lock serializes appends from other processes too, so two
+        # workers never interleave rows or truncate each other's writes
+        with self._lock, file_lock(self.matrix_path):
+            if os.path.exists(self.keys_path):
+                self._sync()
+            new = {k: v for k, v in rows_by_key.items() if k not in self.rows}
+            if not new:
+                return
+            rows = np.asarray(list(new.values()), dtype=np.float32).reshape(len(new), self.width)
+            with open(self.matrix_path, "ab") as f:
+                # Drop rows left behind by an append that crashed before writing its keys
+                f.truncate(len(self.keys) * self.width * ROW_ITEM_BYTES)
+                f.write(rows.tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.write("".join(k + "\n" for k in new).encode())
+            self._sync()
+
+    def compact(self, live_hashes, min_dead_fraction=COMPACT_MIN_DEAD_FRACTION):
+        """
+        Rewrite both files keeping only rows whose image content hash is in
+        live_hashes, once at least min_dead_fraction of the rows are dead.
+        The new files replace the old ones by rename, so readers keep using
+        their mapping of the old file until they refresh. Returns the number
+        of rows dropped.
+        """
+        with self._lock, file_lock(self.matrix_path):
+            if not os.path.exists(self.keys_path):
+                return 0
+            self._sync()
+            keep = [i for i, key in enumerate(self.keys) if self._content_hash(key) in live_hashes]
+            dropped = len(self.keys) - len(keep)
+            if not dropped or dropped < min_dead_fraction * len(self.keys):
+                return 0
+
+            suffix = f".{uuid.uuid4().hex}.part"
+            with open(self.matrix_path + suffix, "wb") as f:
+                for start in range(0, len(keep), COMPACT_CHUNK_ROWS):
+                    f.write(np.ascontiguousarray(self.values[keep[start:start + COMPACT_CHUNK_ROWS]]).tobytes())
+            with open(self.keys_path + suffix, "wb") as f:
+                f.write("".join(self.keys[i] + "\n" for i in keep).encode())
+            # Matrix first: a reader that sees the new keys file also gets the new matrix
+            os.replace(self.matrix_path + suffix, self.matrix_path)
+            os.replace(self.keys_path + suffix, self.keys_path)
+            self._sync()
+            return dropped
+
+## SCORE MATRIX ##
+class ScoreMatrix(MappedMatrix):
+    """
+    N x 7 matrix of emotion scores, one row per image content hash.
+    """
+
+    def __init__(self, matrix_path=MATRIX_PATH, keys_path=KEYS_PATH):
+        super().__init__(matrix_path, keys_path, NUM_EMOTIONS)
+
+    def append_results(self, hashes, results):
+        """
+        Add rows for {path: DeepFace-style result}, scored on the first face.
+        Images without a face get an all-zero row, so they never rank.
+        """
+        self.append({hashes[path]: emotion_vector(result[0]["emotion"] if result else {})
+                     for path, result in results.items() if path in hashes})
+
+    def rank(self, content_hashes, weights, top_n=None):
+        """
+        Score the given images with one matrix-vector product and return
+        [(position in content_hashes, score, dominant emotion)] for the top_n
+        best, highest first. Images with no positive score are dropped.
+        """
+        with self._lock:
+            positions = [i for i, h in enumerate(content_hashes) if h in self.rows]
+            if not positions:
+                return []
+            row_ids = np.fromiter((self.rows[content_hashes[i]] for i in positions), dtype=np.int64)
+            candidates = self.values[row_ids]
+        scores = candidates @ weights
+
+        top_n = min(top_n or len(scores), len(scores))
+        if top_n < len(scores):
+            best = np.argpartition(-scores, top_n - 1)[:top_n]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind="stable")]
+
+        dominant = np.argmax(candidates[best], axis=1)
+        return [
+            (positions[i], float(scores[i]), emotion_labels[d])
+            for i, d in zip(best, dominant)
+            if scores[i] > 0
+        ]
+
+_matrix = None
+_matrix_lock = threading.Lock()
+
+def get_score_matrix():
+    global _matrix
+    with _matrix_lock:
+        if _matrix is None:
+            _matrix = ScoreMatrix()
+            return _matrix
+    _matrix.refresh()
+    return _matrix
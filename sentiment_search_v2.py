@@ -1,38 +1,36 @@
 import re
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from RealtimeSTT import AudioToTextRecorder
 import os
-from PIL import Image
-from PIL.ExifTags import TAGS
-from datetime import datetime
-from deepface import DeepFace
+import sys
 import json
 import cv2
 import threading
-import spacy
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from geopy.geocoders import Nominatim
 from util import complex_emotion_map, emotion_synonyms
+from emotion_backend import get_backend, EMOTION_BATCH_SIZE
+from emotion_cache import get_cache
+from model_registry import get_model
+from score_matrix import get_score_matrix, emotion_weights
+from face_index import get_face_index, has_embeddings
+from date_range import extract_date_range
+from image_index import sync_folder, content_hashes, query_by_date, query_by_location, query_by_area
+from image_metadata import read_image_metadata
+from geocoder import get_geocoder, reverse_geocode_offline, forward_geocode_offline, bbox_around, make_area
 
 ## CONFIGURATION ##
 debug = True
 session_log_path = "session_results_v2.jsonl"
-open(session_log_path, "w").close()  # Clear log file each session
+default_near_radius_km = 25
+voice_folder = "static/images_v2"
+# "auto" falls back to geopy's Nominatim only while no offline gazetteer is installed
+nominatim_fallback = os.getenv("USE_NOMINATIM_FALLBACK", "auto").lower()
 
 def debug_print(*args, **kwargs):
     if debug:
         print(*args, **kwargs)
 
-## CACHING ##
-def load_cache(cache_file="emotion_cache_v2.json"):
-    if os.path.exists(cache_file):
-        with open(cache_file, "r") as f:
-            return json.load(f)
-    return {}
-
-def save_cache(cache, cache_file="emotion_cache_v2.json"):
-    with open(cache_file, "w") as f:
-        json.dump(cache, f, indent=2)
-
 ## LOGGING ##
 def log_prediction(entry_type, input_data, predicted, expected=None, path=session_log_path):
     with open(path, "a") as f:
@@ -47,8 +45,7 @@ def log_prediction(entry_type, input_data, predicted, expected=None, path=sessio
 ## SPEECH PARSING ##
 def extract_query_info(text):
     text = text.lower()
-    analyzer = SentimentIntensityAnalyzer()
-    sentiment = analyzer.polarity_scores(text)
+    sentiment = get_model("vader").polarity_scores(text)
 
     # Base and complex emotions
     deepface_emotions = ["happy", "sad", "angry", "surprise", "fear", "disgust", "neutral"]
@@ -82,14 +79,7 @@ def extract_query_info(text):
             detected_emotion = "neutral"
 
     # Date parsing
-    months = [
-        "january", "february", "march", "april", "may", "june",
-        "july", "august", "september", "october", "november", "december"
-    ]
-    found_month = next((month for month in months if month in text), None)
-
-    year_match = re.search(r"\b(20\d{2}|19\d{2})\b", text)
-    found_year = int(year_match.group(1)) if year_match else None
+    date_range = extract_date_range(text)
 
     # Top N
     top_n = None
@@ -107,15 +97,28 @@ def extract_query_info(text):
                 break
 
     # Location (via spaCy)
-    nlp = spacy.load("en_core_web_sm")
-    doc = nlp(text)
+    doc = get_model("spacy")(text)
     location = None
     for ent in doc.ents:
         if ent.label_ in ("GPE", "LOC", "FAC"):
             location = ent.text
             break
 
-    return detected_emotion, found_month, found_year, top_n, location
+    return detected_emotion, date_range, top_n, location
+
+def extract_radius_km(text):
+    """
+    Radius for proximity queries: "within 10 km of Paris", "within 5 miles of
+    Boston" or just "near Paris" (default radius).
+    """
+    text = text.lower()
+    match = re.search(r"within\s+(\d+(?:\.\d+)?)\s*(km|kilometers?|kilometres?|mi|miles?)\b", text)
+    if match:
+        distance = float(match.group(1))
+        return distance * 1.609 if match.group(2).startswith("mi") else distance
+    if re.search(r"\b(near|around|close to|nearby)\b", text):
+        return default_near_radius_km
+    return None
 
 def word_to_number(word):
     number_words = {
@@ -127,125 +130,226 @@ def word_to_number(word):
 ## IMAGE FILTERING ##
 def get_image_date(image_path):
     try:
-        img = Image.open(image_path)
-        exif_data = img._getexif()
-        if not exif_data:
-            return None
-        for tag_id, value in exif_data.items():
-            tag = TAGS.get(tag_id, tag_id)
-            if tag == "DateTimeOriginal":
-                return datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
+        return read_image_metadata(image_path).taken_at
     except Exception as e:
         debug_print(f"⚠️ Could not get date from {image_path}: {e}")
     return None
 
-def filter_images_by_date(folder, target_month=None, target_year=None):
-    matching_images = []
-    for fname in os.listdir(folder):
-        if not fname.lower().endswith((".jpg", ".jpeg", ".png")):
-            continue
-
-        path = os.path.join(folder, fname)
-        date = get_image_date(path)
-
-        if date:
-            match_month = (target_month is None or date.strftime('%B').lower() == target_month.lower())
-            match_year = (target_year is None or date.year == target_year)
+def filter_images_by_date(folder, date_range=None, sync=True):
+    if sync:
+        sync_folder(folder, reverse_geocode)
+    return query_by_date(folder, date_range)
 
-            if match_month and match_year:
-                matching_images.append(path)
-        else:
-            matching_images.append(path)
 
-    return matching_images
+def use_nominatim():
+    if nominatim_fallback == "auto":
+        return get_geocoder() is None
+    return nominatim_fallback == "true"
 
-
-def dms_to_decimal(dms, ref):
-    degrees, minutes, seconds = dms
-    decimal = degrees + minutes / 60 + seconds / 3600
-    if ref in ['S', 'W']:
-        decimal *= -1
-    return float(decimal)
+def reverse_geocode(lat, lon):
+    location = reverse_geocode_offline(lat, lon)
+    if location or not use_nominatim():
+        return location
+    try:
+        geolocator = Nominatim(user_agent="sentiment-search")
+        location = geolocator.reverse(str(lat)+","+str(lon))
+        return location.address.lower() if location else None
+    except Exception as e:
+        debug_print(f"⚠️ Could not reverse geocode {lat},{lon}: {e}")
+    return None
 
 def get_image_location(image_path):
     try:
-        img = Image.open(image_path)
-        exif_data = img._getexif()
-        if not exif_data:
-            return None
-        for tag_id, value in exif_data.items():
-            tag = TAGS.get(tag_id, tag_id)
-            if tag == "GPSInfo":
-                lat = dms_to_decimal(value[2], value[1])
-                lon = dms_to_decimal(value[4], value[3])
-
-                geolocator = Nominatim(user_agent="sentiment-search")
-                location = geolocator.reverse(str(lat)+","+str(lon))
-
-                return location.address.lower() if location else None
-
+        gps = read_image_metadata(image_path).gps
+        return reverse_geocode(*gps) if gps else None
     except Exception as e:
         debug_print(f"⚠️ Could not get location from {image_path}: {e}")
     return None
 
-def filter_images_by_location(folder, target_location):
-    matching_images = []
-    for fname in os.listdir(folder):
-        if not fname.lower().endswith((".jpg", ".jpeg", ".png")):
-            continue
+@lru_cache(maxsize=256)
+def resolve_location(target_location, radius_km=None):
+    area = forward_geocode_offline(target_location, radius_km)
+    if area or not use_nominatim():
+        return area
+    try:
+        geolocator = Nominatim(user_agent="sentiment-search")
+        location = geolocator.geocode(target_location)
+        if not location:
+            return None
+        center = (location.latitude, location.longitude)
+        if radius_km:
+            return make_area(bbox_around(*center, radius_km), center, radius_km)
+        south, north, west, east = map(float, location.raw["boundingbox"])
+        return make_area((south, north, west, east), center)
+    except Exception as e:
+        debug_print(f"⚠️ Could not geocode {target_location}: {e}")
+    return None
 
-        path = os.path.join(folder, fname)
-        location = get_image_location(path)
-        if location:
-            if not target_location or target_location in location:
-                matching_images.append(path)
+def filter_images_by_location(folder, target_location, radius_km=None, sync=True):
+    if sync:
+        sync_folder(folder, reverse_geocode)
+    if not target_location:
+        return query_by_location(folder, None)
+
+    area = resolve_location(target_location, radius_km)
+    if area is None:
+        if get_geocoder() is None and not use_nominatim():
+            print(f"⚠️ '{target_location}' can't be located: no gazetteer is installed and "
+                  f"USE_NOMINATIM_FALLBACK is off, so photos have no place names to match")
         else:
-            matching_images.append(path)
-
-    return matching_images
-
+            print(f"⚠️ Could not resolve '{target_location}', matching on address text")
+        return query_by_location(folder, target_location)
+    return query_by_area(folder, area)
+
+
+## EMOTION INFERENCE ##
+def analyze_emotions_batch(image_paths, batch_size=None, max_side=None, detections=None):
+    """
+    Emotion results for a batch of images from this process's inference
+    backend (see emotion_backend.py).
+    """
+    return get_backend().analyze(image_paths, batch_size, max_side, detections)
+
+def store_results(results, detections=None):
+    cache = get_cache()
+    cache.put_many(results, detections)
+    hashes = cache.content_hashes(results)
+    get_score_matrix().append_results(hashes, results)
+    get_face_index().append_results(hashes, results)
+
+def analyze_and_store(image_paths):
+    detections = {}
+    results = analyze_emotions_batch(image_paths, detections=detections)
+    store_results(results, detections)
+    return results
+
+def analyze_image(image_path):
+    """
+    Faces found in one image, from the cache when its contents were seen
+    before. Returns [] when no face could be analyzed.
+    """
+    result = get_cache().get(image_path)
+    if not has_embeddings(result):
+        result = analyze_and_store([image_path]).get(image_path)
+    return result or []
 
 ## EMOTION MATCHING ##
-def filter_images_by_emotion(image_paths, desired_emotion, top_n):
-    cache = load_cache()
-    scored_images = []
-    expected_emotions = complex_emotion_map.get(desired_emotion, [desired_emotion])
-
+def _images_to_analyze(missing, hashes, append_results, needs_analysis, analyze_only):
+    """
+    Load cached results for images missing from a store and return the ones
+    that still need inference (limited to analyze_only when given).
+    """
+    if not missing:
+        return []
+    results = get_cache().get_many(missing, hashes)
+    append_results(hashes, results)
+    uncached = [path for path in missing if needs_analysis(results.get(path))]
+    if analyze_only is not None:
+        analyze_only = set(analyze_only)
+        uncached = [path for path in uncached if path in analyze_only]
+    return uncached
+
+def _rank_by_emotion(image_paths, hashes, desired_emotion, top_n):
+    matrix = get_score_matrix()
     for path in image_paths:
-        debug_print(f"🖼️ Analyzing: {os.path.basename(path)}")
-        path_key = os.path.abspath(path)
-        try:
-            if path_key in cache:
-                result = cache[path_key]
-                debug_print("↪ Using cached result")
-            else:
-                result = DeepFace.analyze(img_path=path, actions=["emotion"], enforce_detection=False)
-                for i in range(len(result)):
-                    emotions_converted = {k: float(v) for k, v in result[i]["emotion"].items()}
-                    result[i]["emotion"] = emotions_converted
-                    result[i]["dominant_emotion"] = str(result[i]["dominant_emotion"])
-
-                cache[path_key] = result
-
-            emotion_scores = result[0]["emotion"]
-            dominant_emotion = result[0]["dominant_emotion"].lower()
-            relevant_score = sum(emotion_scores.get(e, 0) for e in expected_emotions)
-
-            if relevant_score > 0:
-                scored_images.append({
-                    "path": path,
-                    "dominant": dominant_emotion,
-                    "score": relevant_score
-                })
-                debug_print(f"→ Detected: {dominant_emotion} | Score: {relevant_score:.2f}")
-
-        except Exception as e:
-            debug_print(f"❌ Error analyzing {path}: {e}")
-
-    save_cache(cache)
-    if not top_n:
-        top_n = len(scored_images)
-    return sorted(scored_images, key=lambda x: x["score"], reverse=True)[:top_n]
+        if hashes.get(path) not in matrix:
+            debug_print(f"⏳ No emotion scores for {path} yet")
+
+    ranked = matrix.rank([hashes.get(path) for path in image_paths], emotion_weights(desired_emotion), top_n)
+    scored_images = []
+    for position, score, dominant_emotion in ranked:
+        path = image_paths[position]
+        scored_images.append({
+            "path": path,
+            "dominant": dominant_emotion,
+            "score": score
+        })
+        debug_print(f"🖼️ {os.path.basename(path)} → Detected: {dominant_emotion} | Score: {score:.2f}")
+    return scored_images
+
+def _rank_by_face(image_paths, hashes, template_embedding, desired_emotion, top_n):
+    ranked = get_face_index().search(template_embedding, [hashes.get(path) for path in image_paths],
+                                     emotion_weights(desired_emotion), top_n)
+    scored_images = []
+    for position, score, dominant_emotion, similarity in ranked:
+        path = image_paths[position]
+        scored_images.append({
+            "path": path,
+            "dominant": dominant_emotion,
+            "score": score
+        })
+        debug_print(f"🖼️ {os.path.basename(path)} → You ({similarity:.2f}) look {dominant_emotion} | Score: {score:.2f}")
+    return scored_images
+
+def _prepare_ranking(image_paths, desired_emotion, top_n, analyze_only, template_embedding):
+    """
+    (images still to analyze, rank function) for an emotion ranking, or an
+    identity ranking when template_embedding is given.
+    """
+    # Hashes come from the metadata index in bulk; only unindexed paths are stat'ed
+    hashes = content_hashes(image_paths)
+    if template_embedding is None:
+        matrix = get_score_matrix()
+        missing = [path for path in image_paths if hashes.get(path) not in matrix]
+        uncached = _images_to_analyze(missing, hashes, matrix.append_results,
+                                      lambda result: result is None, analyze_only)
+        rank = lambda: _rank_by_emotion(image_paths, hashes, desired_emotion, top_n)
+    else:
+        faces = get_face_index()
+        missing = [path for path in image_paths if not faces.has_image(hashes.get(path))]
+        # Results cached before embeddings were stored need another pass
+        uncached = _images_to_analyze(missing, hashes, faces.append_results,
+                                      lambda result: not has_embeddings(result), analyze_only)
+        rank = lambda: _rank_by_face(image_paths, hashes, template_embedding, desired_emotion, top_n)
+    return uncached, rank
+
+def filter_images_by_emotion(image_paths, desired_emotion, top_n, analyze_only=None):
+    """
+    Rank images by how strongly they show desired_emotion. Images without
+    stored scores are analyzed on the spot, unless analyze_only is given, in
+    which case only those paths may trigger inference and the rest are
+    skipped until background ingestion has scored them.
+    """
+    uncached, rank = _prepare_ranking(image_paths, desired_emotion, top_n, analyze_only, None)
+    if uncached:
+        debug_print(f"🧠 Analyzing {len(uncached)} new images in batches of {EMOTION_BATCH_SIZE}")
+        analyze_and_store(uncached)
+    return rank()
+
+def rank_images_progressively(image_paths, desired_emotion, top_n, analyze_only=None,
+                              template_embedding=None, chunk_size=EMOTION_BATCH_SIZE):
+    """
+    The ranking of filter_images_by_emotion (or filter_images_by_face when
+    template_embedding is given), refined as images are analyzed. Yields
+    (scored_images, remaining): first from stored scores alone, then after
+    every chunk_size images analyzed. The last ranking, with remaining == 0,
+    is what the filter function returns.
+    """
+    uncached, rank = _prepare_ranking(image_paths, desired_emotion, top_n, analyze_only, template_embedding)
+    yield rank(), len(uncached)
+    for start in range(0, len(uncached), chunk_size):
+        analyze_and_store(uncached[start:start + chunk_size])
+        yield rank(), max(0, len(uncached) - start - chunk_size)
+
+## IDENTITY MATCHING ##
+def mentions_user(text):
+    """
+    True for queries about the user's own face: "photos of me looking happy",
+    "pictures of myself", "sad ones with me".
+    """
+    return re.search(r"\b(of|with) (me|myself)\b|\bme looking\b|\bmy face\b", text.lower()) is not None
+
+def filter_images_by_face(image_paths, template_embedding, desired_emotion, top_n, analyze_only=None):
+    """
+    Like filter_images_by_emotion, but only faces that match the template's
+    identity count, and each image is scored on its best matching face
+    rather than the first face found.
+    """
+    uncached, rank = _prepare_ranking(image_paths, desired_emotion, top_n, analyze_only, template_embedding)
+    if uncached:
+        debug_print(f"🧠 Computing face embeddings for {len(uncached)} images")
+        analyze_and_store(uncached)
+    return rank()
 
 ## DISPLAY ##
 def show_images(image_results):
@@ -263,21 +367,37 @@ def show_images(image_results):
     cv2.destroyAllWindows()
 
 ## OVERALL LOGIC FLOW ##
-def process_logic(text):
+def voice_candidates(text, date_range, location, folder=voice_folder):
+    # One sync serves both filters
+    sync_folder(folder, reverse_geocode)
+    location_filter = filter_images_by_location(folder, location, extract_radius_km(text), sync=False)
+    date_filter = filter_images_by_date(folder, date_range, sync=False)
+    return sorted(set(location_filter) & set(date_filter))
+
+def search_images(text, parsed, folder=voice_folder):
+    """
+    (matching images, ranked results) for a parsed spoken query.
+    """
+    detected_emotion, date_range, top_n, location = parsed
+    filtered_images = voice_candidates(text, date_range, location, folder)
+    return filtered_images, filter_images_by_emotion(filtered_images, detected_emotion, top_n)
+
+def process_logic(text, search=search_images, display=True):
+    """
+    Parse, search and display one spoken query. search(text, parsed) does
+    the filtering and ranking; speculative voice mode passes its own, which
+    reuses work started while the user was still talking.
+    """
     print("\n📝 You said:", text)
 
-    detected_emotion, month, year, top_n, location = extract_query_info(text)
+    detected_emotion, date_range, top_n, location = extract_query_info(text)
     debug_print(f"😄 Emotion Detected: {detected_emotion}")
 
     if location:
         debug_print(f"📍 Location detected: {location}")
 
-    if month and year:
-        debug_print(f"📆 Timeframe detected: {month.title()} {year}")
-    elif month:
-        debug_print(f"📆 Month detected: {month.title()} (year missing)")
-    elif year:
-        debug_print(f"📆 Year detected: {year} (month missing)")
+    if date_range:
+        debug_print(f"📆 Timeframe detected: {date_range.label.title()}")
     else:
         debug_print("📆 No clear date found.")
 
@@ -285,60 +405,213 @@ def process_logic(text):
 
     predicted_speech_to_text = {
         "emotion": detected_emotion,
-        "month": month,
-        "year": year,
+        "date_range": date_range.label if date_range else None,
         "top_n": top_n
     }
     expected_speech_to_text = {
         "emotion": None,
-        "month": None,
-        "year": None,
+        "date_range": None,
         "top_n": None
     }
     log_prediction("speech_to_text", text, predicted_speech_to_text, expected_speech_to_text)
 
-    folder = "static/images_v2"
     debug_print("\n✅ Ready to search for matching photos...\n")
-    location_filter = filter_images_by_location(folder,location)
-    date_filter = filter_images_by_date(folder, month, year)
-    filtered_images = list(set(location_filter) & set(date_filter))
+    filtered_images, top_emotion_results = search(text, (detected_emotion, date_range, top_n, location))
 
-    debug_print(f"\n📂 Found {len(filtered_images)} images from {month.title()} {year} in {location}:")
+    timeframe = date_range.label.title() if date_range else "any time"
+    debug_print(f"\n📂 Found {len(filtered_images)} images from {timeframe} in {location or 'anywhere'}:")
     for f in filtered_images:
         debug_print(" -", f)
 
-    top_emotion_results = filter_images_by_emotion(filtered_images, detected_emotion, top_n)
-
     debug_print(f"\n✅ Top {top_n} {detected_emotion} images:")
     for r in top_emotion_results:
         debug_print(f" - {r['path']} (Score: {r['score']:.2f}, Emotion: {r['dominant']})")
         predicted_image_emotion = os.path.basename(r["path"]).split("_")[0]
         log_prediction("image", r["path"], predicted=predicted_image_emotion, expected=detected_emotion)
 
-    if top_emotion_results:
+    if not top_emotion_results:
+        print("⚠️ No matching images to display.")
+    elif display:
         print("\n🖼️ Displaying top results...")
         show_images(top_emotion_results)
-    else:
-        print("⚠️ No matching images to display.")
+
+## SPECULATIVE VOICE MODE ##
+def speculation_key(text, parsed):
+    detected_emotion, date_range, top_n, location = parsed
+    return detected_emotion, date_range, top_n, location, extract_radius_km(text)
+
+class SpeculativeSearch:
+    """
+    Runs the search on partial transcripts while the user is still talking.
+    on_partial(text) re-parses each new partial. When the parsed query
+    changes, stale work is cancelled and the new query's metadata filtering
+    and emotion analysis start in the background; analysis runs in chunks
+    and stops between chunks once its query is stale. Everything it analyzes
+    lands in the caches, so nothing is wasted. finish(text, parsed) is a
+    drop-in search for process_logic: when the final query matches the
+    speculation it waits for (or reuses) that result, otherwise it searches
+    normally.
+    """
+
+    def __init__(self, folder=voice_folder, chunk_size=EMOTION_BATCH_SIZE, min_words=2):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.min_words = min_words
+        self.stats = {"partials": 0, "parses": 0, "started": 0, "cancelled": 0, "hits": 0, "misses": 0}
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculate")
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._current = None
+        self._last_text = None
+
+    def on_partial(self, text):
+        text = (text or "").strip()
+        with self._lock:
+            self.stats["partials"] += 1
+            # Partial updates often repeat; only new words are worth a parse
+            if text == self._last_text or len(text.split()) < self.min_words:
+                return
+            self._last_text = text
+            self.stats["parses"] += 1
+        parsed = extract_query_info(text)
+        key = speculation_key(text, parsed)
+
+        with self._lock:
+            if self._current and self._current[0] == key:
+                return
+            self._cancel()
+            generation = self._generation
+            self._current = (key, self._pool.submit(self._prefetch, text, parsed, generation))
+            self.stats["started"] += 1
+        debug_print(f"🔮 Prefetching for \"{text}\"")
+
+    def _cancel(self):
+        # Bumping the generation stops running work at its next chunk
+        self._generation += 1
+        if self._current:
+            if not self._current[1].done():
+                self._current[1].cancel()
+                self.stats["cancelled"] += 1
+            self._current = None
+
+    def _prefetch(self, text, parsed, generation):
+        detected_emotion, date_range, top_n, location = parsed
+        filtered_images = voice_candidates(text, date_range, location, self.folder)
+        ranked = []
+        for ranked, _ in rank_images_progressively(filtered_images, detected_emotion, top_n,
+                                                   chunk_size=self.chunk_size):
+            if generation != self._generation:
+                return None
+        return filtered_images, ranked
+
+    def finish(self, text, parsed):
+        key = speculation_key(text, parsed)
+        with self._lock:
+            current = self._current
+            if current and current[0] != key:
+                self._cancel()
+                current = None
+            self._current, self._last_text = None, None
+
+        result = None
+        if current and not current[1].cancelled():
+            try:
+                result = current[1].result()
+            except Exception as e:
+                print(f"⚠️ Speculative search failed: {e}")
+        with self._lock:
+            self.stats["hits" if result is not None else "misses"] += 1
+        if result is not None:
+            debug_print("⚡ Using results prefetched while you were speaking")
+            return result
+        return search_images(text, parsed, self.folder)
+
+    def close(self):
+        with self._lock:
+            self._cancel()
+        self._pool.shutdown(wait=True)
+
+class ScriptedRecorder:
+    """
+    Stand-in for RealtimeSTT's AudioToTextRecorder that replays scripted
+    utterances. Each text() call feeds one utterance to the real-time
+    callback a word at a time, word_delay seconds apart, then hands the full
+    utterance to the callback, the way speech ends in the real recorder.
+    """
+
+    def __init__(self, utterances, on_realtime_transcription_update=None, word_delay=0.3, **kwargs):
+        self.utterances = list(utterances)
+        self.on_realtime_transcription_update = on_realtime_transcription_update
+        self.word_delay = word_delay
+
+    def text(self, on_transcription_finished):
+        if not self.utterances:
+            raise EOFError("No scripted utterances left")
+        utterance = self.utterances.pop(0)
+        words = utterance.split()
+        for i in range(1, len(words) + 1):
+            time.sleep(self.word_delay)
+            if self.on_realtime_transcription_update:
+                self.on_realtime_transcription_update(" ".join(words[:i]))
+        on_transcription_finished(utterance)
 
 if __name__ == '__main__':
-    print("🎉 Welcome to SentimentSearch!")
-    print("🎤 Please wait for the prompt, then speak your query.")
-    print("💬 Try something like: 'Show me the top 4 not negative pictures from March of 2025 in Paris'\n")
+    if len(sys.argv) > 1 and sys.argv[1] == "index":
+        from indexer import main
+        main(sys.argv[2:])
+        sys.exit(0)
+
+    # Only voice sessions start a fresh log; the indexer's spawned workers
+    # re-import this module as __mp_main__ and must not truncate it
+    open(session_log_path, "w").close()  # Clear log file each session
+
+    # --speculative searches on partial transcripts while you speak;
+    # --script FILE replays one utterance per line instead of using the microphone
+    speculation = SpeculativeSearch() if "--speculative" in sys.argv else None
+    script = sys.argv[sys.argv.index("--script") + 1] if "--script" in sys.argv else None
+    realtime = {}
+    if speculation:
+        realtime = {"enable_realtime_transcription": True,
+                    "on_realtime_transcription_update": speculation.on_partial}
+    search = speculation.finish if speculation else search_images
 
-    recorder = AudioToTextRecorder()
+    print("🎉 Welcome to SentimentSearch!")
+    if script:
+        with open(script) as f:
+            recorder = ScriptedRecorder([line.strip() for line in f if line.strip()], **realtime)
+    else:
+        print("🎤 Please wait for the prompt, then speak your query.")
+        print("💬 Try something like: 'Show me the top 4 not negative pictures from March of 2025 in Paris'\n")
+        # Imported here so the speech stack only loads for microphone sessions
+        from RealtimeSTT import AudioToTextRecorder
+        recorder = AudioToTextRecorder(**realtime)
+
+    def timed_search(text, parsed):
+        start = time.perf_counter()
+        result = search(text, parsed)
+        debug_print(f"⏱️ Results ready {time.perf_counter() - start:.2f}s after you finished speaking")
+        return result
 
     while True:
         done_event = threading.Event()
 
         def wrapped_process_logic(text):
-            process_logic(text)
+            process_logic(text, timed_search, display=not script)
             done_event.set()
 
-        recorder.text(wrapped_process_logic)
+        try:
+            recorder.text(wrapped_process_logic)
+        except EOFError:
+            break
         done_event.wait()
 
+        if script:
+            continue
         cont = input("\n🔁 Do you want to try another query? (yes/no): ").strip().lower()
         if cont not in ["yes", "y"]:
             print("👋 Goodbye! Thanks for using SentimentSearch.")
             break
+
+    if speculation:
+        speculation.close()
+        print(f"🔮 Speculation: {speculation.stats}")
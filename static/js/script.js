@@ -24,27 +24,82 @@ const sendQuery = (useAI) => {
   resultsDiv.innerHTML = "<img src = 'static/loading.gif'/>";
   saveQueryToHistory(query);
 
-  let uploaded = JSON.parse(localStorage.getItem("uploaded") || "[]");
-
-  fetch("/process_query", {
+  // Uploads are stored on the server; queries only reference their IDs
+  const session = localStorage.getItem("uploadSession");
+  const uploaded = JSON.parse(localStorage.getItem("uploaded") || "[]")
+    .filter((item) => item.id)
+    .map((item) => item.id);
+
+  // Results stream in as newline-delimited JSON events: the parsed query,
+  // provisional rankings while photos are analyzed, then the final ranking
+  fetch("/process_query_stream", {
     method: "POST",
     headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ query, uploaded, useAI }),
+    body: JSON.stringify({ query, uploaded, session, useAI }),
   })
-    .then((response) => response.json())
-    .then((data) => {
-      const emotion = data.emotion;
-      resultsDiv.innerHTML = "";
-      if (data.results.length === 0) {
-        resultsDiv.innerHTML = "<p>No matching images found.</p>";
-        return;
-      }
+    .then((response) => {
+      if (!response.ok) throw new Error(response.statusText);
+      return readEvents(response, (event) => handleSearchEvent(event, resultsDiv));
+    })
+    .catch((err) => {
+      showToast(`something went wrong while searching: ${err.message}`);
+    })
+    .finally(() => {
+      searchBtn.disabled = false;
+      searchBtn.innerText = "Search";
+    });
+};
+
+// Throws on an "error" event, and when the stream ends without "done"
+// (e.g. the server died partway through), so callers never take a
+// provisional ranking for the final one
+const readEvents = async (response, onEvent) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let finished = false;
+  const handle = (line) => {
+    const event = JSON.parse(line);
+    if (event.event === "error") throw new Error(event.error);
+    if (event.event === "done") finished = true;
+    onEvent(event);
+  };
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split("\n");
+    buffer = lines.pop();
+    lines.filter((line) => line.trim()).forEach(handle);
+  }
+  if (buffer.trim()) handle(buffer);
+  if (!finished) throw new Error("the search ended before finishing");
+};
+
+const handleSearchEvent = (event, resultsDiv) => {
+  if (event.event === "query") {
+    const parts = [event.emotion, event.date_range, event.top_n && `top ${event.top_n}`].filter(Boolean);
+    if (parts.length) showToast(`Searching for ${parts.join(", ")}...`);
+  } else if (event.event === "results") {
+    renderResults(resultsDiv, event.results, event.emotion,
+      `<p class="refining">Refining... ${event.remaining} photos left to analyze</p>`);
+  } else if (event.event === "done") {
+    renderResults(resultsDiv, event.results, event.emotion);
+    if (event.results.length === 0) {
+      resultsDiv.innerHTML = "<p>No matching images found.</p>";
+      return;
+    }
+    showToast(`Search completed in ${event.time_elapsed} seconds`);
+  }
+};
 
-      showToast(`Search completed in ${data.time_elapsed} seconds`);
-      data.results.forEach((img) => {
-        resultsDiv.innerHTML += `
+const renderResults = (resultsDiv, results, emotion, status = "") => {
+  resultsDiv.innerHTML = status;
+  results.forEach((img) => {
+    const src = (img.thumbnails && img.thumbnails.medium) || img.image_url;
+    resultsDiv.innerHTML += `
                 <div class="result">
-                    <img src="${img.image_url}" alt="Image">
+                    <a href="${img.image_url}" target="_blank"><img src="${src}" alt="Image" loading="lazy"></a>
                     <br>
                     <button onclick="this.disabled=true; addToFavorites('${img.image_url}'); setTimeout(() => {this.disabled = false; }, 5000);">⭐ Favorite</button>
                     <button onclick="document.getElementById('link').click()">📥 Download</button>
@@ -53,15 +108,7 @@ const sendQuery = (useAI) => {
                     <button class="upvote" onclick="this.disabled=true;this.classList.add('disabled-button'); userEvaluate('${img.image_url}','${emotion}',true)">👍</button><button class="downvote" onclick="this.disabled=true;  this.classList.add('disabled-button'); userEvaluate('${img.image_url}','${emotion}',false)">👎</button>
                 </div>
             `;
-      });
-    })
-    .catch((err) => {
-      showToast("something went wrong while searching.");
-    })
-    .finally(() => {
-      searchBtn.disabled = false;
-      searchBtn.innerText = "Search";
-    });
+  });
 };
 
 const startListening = () => {
@@ -292,7 +339,7 @@ const showPhotos = () => {
         <div>
             <h3>Your Photos</h3>
             <button onclick="document.getElementById('uploadInput').click()">📤 Upload</button>
-            <input type="file" id="uploadInput" accept="image/*" style="display:none" onchange="handleUpload(event)">
+            <input type="file" id="uploadInput" accept="image/jpeg,image/png" multiple style="display:none" onchange="handleUpload(event)">
         </div>
     `;
 
@@ -303,55 +350,89 @@ const showPhotos = () => {
 }
 
 const showAllPhotos = () => {
-    const photoDiv = document.getElementById("all");
-    photoDiv.innerHTML = `
+  const photoDiv = document.getElementById("all");
+  photoDiv.innerHTML = `
       <div>
         <h3>All Photos in Search Database</h3>
       </div>
+      <div id="all-grid"></div>
+      <button id="load-more" class="hidden" onclick="loadPhotoPage()">Load more</button>
     `;
-  
-    fetch('/all_photos')
-      .then(response => response.json())
-      .then((Photos) => {
-        console.log(Photos)
-        if (Photos.length === 0) {
-          photoDiv.innerHTML += "<p>No Photos yet.</p>";
-          return;
-        }
-  
-        Photos.forEach((url) => {
-          photoDiv.innerHTML += `
+  nextPhotoPage = 1;
+  loadPhotoPage();
+};
+
+// The gallery loads the library a page of thumbnails at a time
+let nextPhotoPage = 1;
+
+const loadPhotoPage = () => {
+  const grid = document.getElementById("all-grid");
+  const loadMore = document.getElementById("load-more");
+  fetch(`/photos?page=${nextPhotoPage}`)
+    .then((response) => response.json())
+    .then((data) => {
+      if (data.total === 0) {
+        grid.innerHTML = "<p>No Photos yet.</p>";
+        return;
+      }
+
+      data.photos.forEach((photo) => {
+        const src = (photo.thumbnails && photo.thumbnails.small) || photo.image_url;
+        grid.innerHTML += `
             <div class="result">
-              <img src="${url}" alt="photo">
+              <a href="${photo.image_url}" target="_blank"><img src="${src}" alt="photo" loading="lazy"></a>
             </div>
           `;
-        });
       });
-  };
-  
+      nextPhotoPage = data.page + 1;
+      loadMore.classList.toggle("hidden", data.page * data.per_page >= data.total);
+    })
+    .catch((err) => {
+      console.error("Could not load photos", err);
+    });
+};
 
 function handleUpload(event) {
-  const file = event.target.files[0];
-  if (!file) return;
-
-  const reader = new FileReader();
-  reader.onload = function (e) {
-    const imageUrl = e.target.result;
+  const files = event.target.files;
+  if (!files.length) return;
 
-    const uploadedPhotos = JSON.parse(localStorage.getItem("uploaded") || "[]");
-    uploadedPhotos.push({ url: e.target.result });
-    localStorage.setItem("uploaded", JSON.stringify(uploadedPhotos));
-    showToast("Photo uploaded successfully!");
-
-    showPhotos();
-  };
+  const formData = new FormData();
+  for (const file of files) {
+    formData.append("images", file);
+  }
+  const session = localStorage.getItem("uploadSession");
+  if (session) formData.append("session", session);
 
-  reader.readAsDataURL(file);
+  fetch("/uploads", {
+    method: "POST",
+    body: formData,
+  })
+    .then((res) => res.json())
+    .then((data) => {
+      if (data.error) {
+        showToast(data.error);
+        return;
+      }
+      localStorage.setItem("uploadSession", data.session);
+      // Entries from before uploads were stored on the server have no id
+      let uploadedPhotos = JSON.parse(localStorage.getItem("uploaded") || "[]").filter((item) => item.id);
+      data.uploads.forEach((upload) => {
+        if (!uploadedPhotos.some((item) => item.id === upload.id)) {
+          uploadedPhotos.push(upload);
+        }
+      });
+      localStorage.setItem("uploaded", JSON.stringify(uploadedPhotos));
+      showToast("Photo uploaded successfully!");
+      showPhotos();
+    })
+    .catch(() => showToast("Upload failed."));
 }
 
-const removeFromUpload = (url) => {
+const removeFromUpload = (id) => {
+  const session = localStorage.getItem("uploadSession");
+  fetch(`/uploads/${session}/${id}`, { method: "DELETE" }).catch(() => {});
   let uploaded = JSON.parse(localStorage.getItem("uploaded") || "[]");
-  uploaded = uploaded.filter((item) => item.url !== url);
+  uploaded = uploaded.filter((item) => item.id !== id);
   localStorage.setItem("uploaded", JSON.stringify(uploaded));
   showToast("Removed from uploaded!");
   showPhotos();
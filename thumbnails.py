@@ -0,0 +1,125 @@
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+from emotion_cache import get_cache
+from image_index import content_hashes
+from util import JPEG_FORMATS
+
+## CONFIGURATION ##
+THUMBNAIL_ROOT = "static/thumbnails"
+# Longest side in pixels per size name; "small" fills the gallery, "medium" the result grid
+THUMBNAIL_SIZES = {"small": 256, "medium": 768}
+THUMBNAIL_QUALITY = 80
+# Background threads making thumbnails requested by the web app
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+
+class ThumbnailStore:
+    """
+    Downscaled JPEG copies of photos, stored under their content hash as
+    <root>/<size>/<hash[:2]>/<hash>.jpg. The same photo in two folders (or
+    uploaded twice) shares its thumbnails, and a file's thumbnails never
+    change, so browsers can revalidate them cheaply.
+    """
+
+    def __init__(self, root=THUMBNAIL_ROOT, sizes=THUMBNAIL_SIZES, quality=THUMBNAIL_QUALITY, workers=THUMBNAIL_WORKERS):
+        self.root = root
+        self.sizes = sizes
+        self.quality = quality
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnails")
+        self._queued = set()
+        self._queued_lock = threading.Lock()
+
+    def path(self, content_hash, size):
+        return os.path.join(self.root, size, content_hash[:2], content_hash + ".jpg")
+
+    def url(self, content_hash, size):
+        return "/" + self.path(content_hash, size).replace("\\", "/")
+
+    def has(self, content_hash):
+        return all(os.path.exists(self.path(content_hash, size)) for size in self.sizes)
+
+    ## GENERATION ##
+    def generate(self, image_path, content_hash):
+        """
+        Write every missing size for one photo from a single decode, largest
+        first so each smaller size is scaled from the previous one.
+        """
+        missing = [size for size in self.sizes if not os.path.exists(self.path(content_hash, size))]
+        if not missing:
+            return
+        missing.sort(key=lambda size: -self.sizes[size])
+        with Image.open(image_path) as img:
+            largest = self.sizes[missing[0]]
+            if img.format in JPEG_FORMATS:
+                img.draft("RGB", (largest, largest))
+            img = ImageOps.exif_transpose(img).convert("RGB")
+        for size in missing:
+            img.thumbnail((self.sizes[size], self.sizes[size]))
+            path = self.path(content_hash, size)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so readers never see half a thumbnail
+            partial_path = f"{path}.{uuid.uuid4().hex}.part"
+            img.save(partial_path, format="JPEG", quality=self.quality, optimize=True)
+            os.replace(partial_path, path)
+
+    def ensure(self, image_paths):
+        """
+        {path: content hash} for the given photos, generating thumbnails for
+        any that have none yet. Photos that can't be read are left out.
+        """
+        hashes = get_cache().content_hashes(image_paths)
+        for path, content_hash in list(hashes.items()):
+            if self.has(content_hash):
+                continue
+            try:
+                self.generate(path, content_hash)
+            except Exception as e:
+                print(f"⚠️ Could not make thumbnails for {path}: {e}")
+                del hashes[path]
+        return hashes
+
+    def queue(self, image_path, content_hash):
+        """
+        Generate one photo's thumbnails in the background, once.
+        """
+        with self._queued_lock:
+            if content_hash in self._queued:
+                return
+            self._queued.add(content_hash)
+        self.pool.submit(self._generate_queued, image_path, content_hash)
+
+    def _generate_queued(self, image_path, content_hash):
+        try:
+            self.generate(image_path, content_hash)
+        except Exception as e:
+            print(f"⚠️ Could not make thumbnails for {image_path}: {e}")
+        finally:
+            with self._queued_lock:
+                self._queued.discard(content_hash)
+
+    def urls(self, image_paths):
+        """
+        {path: {size: URL}} without waiting on any decoding: photos whose
+        thumbnails don't exist yet get the original's URL for every size and
+        are queued, so a later request gets the thumbnails.
+        """
+        found = {}
+        for path, content_hash in content_hashes(image_paths).items():
+            if self.has(content_hash):
+                found[path] = {size: self.url(content_hash, size) for size in self.sizes}
+            else:
+                self.queue(path, content_hash)
+                found[path] = {size: "/" + path.replace("\\", "/") for size in self.sizes}
+        return found
+
+_thumbnails = None
+_thumbnails_lock = threading.Lock()
+
+def get_thumbnail_store():
+    global _thumbnails
+    with _thumbnails_lock:
+        if _thumbnails is None:
+            _thumbnails = ThumbnailStore()
+    return _thumbnails
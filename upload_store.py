@@ -0,0 +1,120 @@
+import hashlib
+import os
+import re
+import shutil
+import time
+import uuid
+from image_index import IMAGE_EXTENSIONS
+
+## CONFIGURATION ##
+UPLOAD_ROOT = "static/user_uploads"
+UPLOAD_CHUNK_SIZE = 1 << 16
+# Sessions nobody has uploaded to or queried for this long are deleted
+UPLOAD_SESSION_MAX_AGE = float(os.getenv("UPLOAD_SESSION_MAX_AGE_DAYS", "7")) * 86400
+
+SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+UPLOAD_ID = re.compile(r"^[0-9a-f]{64}$")
+
+class UploadStore:
+    """
+    Uploaded photos, kept byte-for-byte (EXIF included) under their SHA-256
+    in one folder per session: <root>/<session>/<hash><ext>. The upload ID
+    is the hash, so uploading the same photo twice stores it once, and the
+    emotion cache and metadata index recognize it on every later query.
+    """
+
+    def __init__(self, root=UPLOAD_ROOT, max_age=UPLOAD_SESSION_MAX_AGE):
+        self.root = root
+        self.max_age = max_age
+        os.makedirs(root, exist_ok=True)
+
+    ## SESSIONS ##
+    def session(self, session_id=None):
+        """
+        The given session if it is a valid ID, otherwise a new one.
+        """
+        if session_id and SESSION_ID.match(session_id):
+            return session_id
+        return uuid.uuid4().hex
+
+    def folder(self, session_id):
+        return os.path.join(self.root, session_id)
+
+    def touch(self, session_id):
+        folder = self.folder(session_id)
+        if os.path.isdir(folder):
+            os.utime(folder)
+
+    def prune(self):
+        """
+        Delete sessions that have not been used for max_age seconds and
+        return the paths of the photos that went with them.
+        """
+        cutoff = time.time() - self.max_age
+        removed = []
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and SESSION_ID.match(entry.name) and entry.stat().st_mtime < cutoff:
+                removed += [os.path.join(entry.path, name) for name in os.listdir(entry.path)]
+                shutil.rmtree(entry.path, ignore_errors=True)
+        return removed
+
+    ## UPLOADS ##
+    def check_filename(self, filename):
+        """
+        The file's lowercase extension; raises ValueError for non-image file types.
+        """
+        ext = os.path.splitext(filename or "")[1].lower()
+        if ext not in IMAGE_EXTENSIONS:
+            raise ValueError(f"Unsupported file type '{ext or filename}'")
+        return ext
+
+    def save(self, session_id, stream, filename):
+        """
+        Copy an upload stream to disk in chunks, hashing as it goes, and
+        return its upload ID. Raises ValueError for non-image file types.
+        """
+        ext = self.check_filename(filename)
+        folder = self.folder(session_id)
+        os.makedirs(folder, exist_ok=True)
+
+        digest = hashlib.sha256()
+        partial_path = os.path.join(folder, f".{uuid.uuid4().hex}.part")
+        try:
+            with open(partial_path, "wb") as f:
+                for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    f.write(chunk)
+            upload_id = digest.hexdigest()
+            existing = self.path(session_id, upload_id)
+            if existing:
+                os.remove(partial_path)
+            else:
+                os.replace(partial_path, os.path.join(folder, upload_id + ext))
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        self.touch(session_id)
+        return upload_id
+
+    def path(self, session_id, upload_id):
+        if not SESSION_ID.match(session_id or "") or not UPLOAD_ID.match(upload_id or ""):
+            return None
+        for ext in IMAGE_EXTENSIONS:
+            path = os.path.join(self.folder(session_id), upload_id + ext)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def paths(self, session_id, upload_ids):
+        """
+        Paths of the given uploads that exist in the session; unknown IDs are skipped.
+        """
+        paths = [self.path(session_id, upload_id) for upload_id in upload_ids or []]
+        return [path for path in paths if path]
+
+    def delete(self, session_id, upload_id):
+        path = self.path(session_id, upload_id)
+        if path:
+            os.remove(path)
+        return path
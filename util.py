@@ -1,4 +1,12 @@
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+
 ## EMOTION MAP ##
+# Output order of DeepFace's emotion model; also the column order of stored score vectors
+emotion_labels = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+
 complex_emotion_map = {
     "goofy": ["happy", "surprise", "neutral"],
     "silly": ["happy", "surprise"],
@@ -44,3 +52,62 @@ emotion_synonyms = {
     "hope": "hopeful",
     "peace": "peaceful"
 }
+
+## CONTENT HASHING ##
+def bytes_content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def file_content_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+## IMAGE FORMATS ##
+# Pillow formats that decode through libjpeg and support draft mode; iPhone
+# photos open as MPO (a JPEG with extra frames), not JPEG
+JPEG_FORMATS = ("JPEG", "MPO")
+
+## STORAGE ##
+def store_path(filename):
+    """
+    Where a derived emotion store lives. EMOTION_STORE_DIR moves all of them
+    (cache, score matrix, face index) at once, e.g. to keep benchmark runs
+    with the stub backend away from real results.
+    """
+    store_dir = os.getenv("EMOTION_STORE_DIR")
+    if not store_dir:
+        return filename
+    os.makedirs(store_dir, exist_ok=True)
+    return os.path.join(store_dir, filename)
+
+## FILE LOCKING ##
+@contextmanager
+def file_lock(path):
+    """
+    Exclusive lock on a sidecar "<path>.lock" file, held against other
+    threads and other processes (e.g. several web workers) alike.
+    """
+    with open(path + ".lock", "a+") as f:
+        if os.name == "nt":
+            import msvcrt
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)  # LK_LOCK gives up after ~10 s; keep waiting
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)